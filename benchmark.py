@@ -0,0 +1,301 @@
+"""Benchmark reproducible de /chat con Gemini, Postgres y Twilio simulados.
+
+Reproduce un corpus de mensajes contra la app en proceso y reporta
+throughput, latencia de cola (p50/p95/p99) y el desglose por etapa de
+metricas.py. Con --umbral-p95 sale con código 1 si la p95 lo supera, para
+usarlo como control antes de desplegar.
+
+    python benchmark.py
+    python benchmark.py --corpus mensajes.jsonl --concurrencia 32 --latencia-modelo 0.8
+    python benchmark.py --asincrono --json resultado.json --umbral-p95 0.05
+
+El corpus es JSONL (se toma el campo mensaje/Body/body/texto/title de cada
+línea) o texto plano, un mensaje por línea.
+"""
+import sys
+import json
+import time
+import random
+import logging
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+CORPUS_BASE = [
+    "Hola",
+    "Buenos días doctor",
+    "Tengo dolor de cabeza desde ayer",
+    "me duele la cabeza",
+    "Qué puedo desayunar?",
+    "qué desayunar",
+    "Tengo estreñimiento hace una semana",
+    "Cómo puedo dormir mejor?",
+    "Tengo ansiedad por las noches",
+    "Me duele el estómago después de comer",
+    "Qué remedios naturales hay para la gripe?",
+    "Cuánta agua debo tomar al día",
+    "tengo la presión alta, qué me recomiendas",
+    "Mi papá tuvo un paro cardiaco",
+    "Creo que es un infarto, me duele el pecho",
+    "Tengo dolor de cabeza desde ayer",
+    "Es bueno hacer ejercicio en ayunas?",
+    "Qué frutas son buenas para la diabetes",
+]
+
+CAMPOS_MENSAJE = ("mensaje", "Body", "body", "texto", "title")
+
+
+def cargar_corpus(ruta):
+    if not ruta:
+        return list(CORPUS_BASE)
+    mensajes = []
+    with open(ruta, encoding="utf-8") as f:
+        for linea in f:
+            linea = linea.strip()
+            if not linea:
+                continue
+            try:
+                datos = json.loads(linea)
+            except ValueError:
+                mensajes.append(linea)
+                continue
+            if isinstance(datos, dict):
+                texto = next((datos[c] for c in CAMPOS_MENSAJE if datos.get(c)), None)
+                if texto:
+                    mensajes.append(str(texto))
+            elif isinstance(datos, str):
+                mensajes.append(datos)
+    return mensajes
+
+
+# --- DOBLES DE PRUEBA ---
+class _Respuesta:
+
+    def __init__(self, texto):
+        self.text = texto
+
+
+class ModeloFalso:
+    """Imita GenerativeModel: latencia configurable y respuestas en Markdown."""
+
+    def __init__(self, latencia, variacion, semilla):
+        self.latencia = latencia
+        self.variacion = variacion
+        self._azar = random.Random(semilla)
+        self._lock = threading.Lock()
+        self.llamadas = 0
+
+    def _esperar(self):
+        with self._lock:
+            self.llamadas += 1
+            espera = max(0.0, self._azar.gauss(self.latencia, self.variacion))
+        time.sleep(espera)
+
+    def _texto(self, prompt):
+        return f"**Dr. Lucas:** respuesta simulada a {prompt[-60:]!r}\n- Agua\n- Descanso\n\n_Salmos 37:5_"
+
+    def start_chat(self, history=None):
+        return self
+
+    def send_message(self, prompt, stream=False):
+        self._esperar()
+        texto = self._texto(prompt)
+        if stream:
+            return [_Respuesta(texto[i:i + 20]) for i in range(0, len(texto), 20)]
+        return _Respuesta(texto)
+
+    def generate_content(self, prompt):
+        self._esperar()
+        return _Respuesta("Resumen simulado de la conversación.")
+
+
+def instalar_dobles(bot_core, args):
+    import persistencia
+    from memoria import memoria, Sesion
+
+    modelo = ModeloFalso(args.latencia_modelo, args.variacion_modelo, args.semilla)
+    bot_core.model = modelo
+    bot_core.modelo_resumen = modelo
+
+    filas = []
+
+    def escribir_falso(lote, intentos=2):
+        time.sleep(args.latencia_db)
+        filas.extend(lote)
+        return True
+
+    persistencia.escritor._escribir = escribir_falso
+
+    def cargar_falso(celular):
+        time.sleep(args.latencia_db)
+        return Sesion()
+
+    def sincronizar_falso(celular, sesion):
+        time.sleep(args.latencia_db)
+        return True
+
+    memoria._cargar = cargar_falso
+    memoria._sincronizar = sincronizar_falso
+
+    envios = []
+
+    def enviar_falso(destino, origen, texto):
+        time.sleep(args.latencia_twilio)
+        envios.append(destino)
+
+    bot_core.cola_mensajes.enviador = enviar_falso
+    return modelo, filas, envios
+
+
+class SinLimite:
+
+    def permitir(self, clave):
+        return True
+
+
+def percentil(valores, q):
+    if not valores:
+        return 0.0
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(q * len(ordenados)))]
+
+
+def ejecutar(args):
+    import metricas
+    if not args.verbose:
+        logging.getLogger("cuerpofiel").setLevel(logging.WARNING)
+
+    import bot_core
+    from cache_respuestas import cache
+
+    modelo, filas, envios = instalar_dobles(bot_core, args)
+    if not args.con_limite:
+        bot_core.limitador = SinLimite()
+    if args.sin_cache:
+        cache.max_entradas = 0
+    bot_core.WHATSAPP_MODO_ASINCRONO = args.asincrono
+    metricas.registro.reiniciar()
+
+    corpus = cargar_corpus(args.corpus)
+    if not corpus:
+        sys.exit("El corpus está vacío")
+    azar = random.Random(args.semilla)
+    trabajos = []
+    for i in range(len(corpus) * args.repeticiones):
+        mensaje = corpus[i % len(corpus)]
+        numero = f"+5215500{azar.randrange(args.usuarios):05d}"
+        trabajos.append((i, mensaje, numero))
+
+    app = bot_core.app
+    latencias = []
+    errores = []
+    lock = threading.Lock()
+    local = threading.local()
+
+    def enviar(trabajo):
+        i, mensaje, numero = trabajo
+        cliente = getattr(local, "cliente", None)
+        if cliente is None:
+            cliente = local.cliente = app.test_client()
+        inicio = time.perf_counter()
+        if args.canal == "web":
+            r = cliente.post("/chat", json={"mensaje": mensaje})
+        else:
+            r = cliente.post("/chat", data={"From": f"whatsapp:{numero}", "To": "whatsapp:+14155238886",
+                                            "Body": mensaje, "MessageSid": f"SMbench{i:08d}"})
+        duracion = time.perf_counter() - inicio
+        with lock:
+            latencias.append(duracion)
+            if r.status_code != 200:
+                errores.append(r.status_code)
+
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrencia) as ejecutor:
+        list(ejecutor.map(enviar, trabajos))
+    if args.asincrono:
+        bot_core.cola_mensajes.esperar()
+    total = time.perf_counter() - inicio
+
+    histogramas, contadores = metricas.registro.resumen()
+    etapas = {
+        dict(etiquetas)["etapa"]: {"n": n, "p50": c[0.5], "p95": c[0.95], "p99": c[0.99]}
+        for (nombre, etiquetas), (n, _, c) in sorted(histogramas.items())
+        if nombre == "etapa_segundos"
+    }
+    return {
+        "peticiones": len(trabajos),
+        "errores": len(errores),
+        "concurrencia": args.concurrencia,
+        "canal": args.canal,
+        "asincrono": args.asincrono,
+        "duracion_s": round(total, 4),
+        "throughput_rps": round(len(trabajos) / total, 2),
+        "latencia_s": {
+            "p50": percentil(latencias, 0.5),
+            "p95": percentil(latencias, 0.95),
+            "p99": percentil(latencias, 0.99),
+            "max": max(latencias),
+        },
+        "llamadas_modelo": modelo.llamadas,
+        "envios_twilio": len(envios),
+        "filas_historial": len(filas),
+        "contadores": {
+            nombre + ("{" + ",".join(f"{k}={v}" for k, v in etiquetas) + "}" if etiquetas else ""): valor
+            for (nombre, etiquetas), valor in sorted(contadores.items())
+        },
+        "etapas_s": etapas,
+    }
+
+
+def imprimir(resultado):
+    lat = resultado["latencia_s"]
+    print(f"Peticiones: {resultado['peticiones']}  errores: {resultado['errores']}  "
+          f"concurrencia: {resultado['concurrencia']}  canal: {resultado['canal']}"
+          f"{' (asíncrono)' if resultado['asincrono'] else ''}")
+    print(f"Duración: {resultado['duracion_s']:.2f} s  throughput: {resultado['throughput_rps']:.1f} req/s  "
+          f"llamadas al modelo: {resultado['llamadas_modelo']}")
+    print(f"Latencia /chat  p50 {lat['p50'] * 1000:8.2f} ms  p95 {lat['p95'] * 1000:8.2f} ms  "
+          f"p99 {lat['p99'] * 1000:8.2f} ms  max {lat['max'] * 1000:8.2f} ms")
+    print()
+    print(f"{'etapa':<26}{'n':>7}{'p50 ms':>11}{'p95 ms':>11}{'p99 ms':>11}")
+    for etapa, datos in resultado["etapas_s"].items():
+        print(f"{etapa:<26}{datos['n']:>7}{datos['p50'] * 1000:>11.3f}{datos['p95'] * 1000:>11.3f}"
+              f"{datos['p99'] * 1000:>11.3f}")
+    print()
+    for nombre, valor in resultado["contadores"].items():
+        print(f"{nombre}: {valor}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", help="JSONL o texto plano; por defecto un corpus interno")
+    parser.add_argument("--repeticiones", type=int, default=20)
+    parser.add_argument("--concurrencia", type=int, default=16)
+    parser.add_argument("--usuarios", type=int, default=50, help="números distintos que envían mensajes")
+    parser.add_argument("--canal", choices=("whatsapp", "web"), default="whatsapp")
+    parser.add_argument("--asincrono", action="store_true", help="webhook con acuse inmediato (cola_whatsapp)")
+    parser.add_argument("--sin-cache", action="store_true")
+    parser.add_argument("--con-limite", action="store_true", help="mantener el límite por número")
+    parser.add_argument("--latencia-modelo", type=float, default=0.05)
+    parser.add_argument("--variacion-modelo", type=float, default=0.01)
+    parser.add_argument("--latencia-db", type=float, default=0.002)
+    parser.add_argument("--latencia-twilio", type=float, default=0.01)
+    parser.add_argument("--semilla", type=int, default=1234)
+    parser.add_argument("--json", help="guardar el resultado en este archivo")
+    parser.add_argument("--umbral-p95", type=float, help="segundos; falla si la p95 de /chat lo supera")
+    parser.add_argument("--verbose", action="store_true", help="mostrar los logs JSON de la app")
+    args = parser.parse_args(argv)
+
+    resultado = ejecutar(args)
+    imprimir(resultado)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(resultado, f, ensure_ascii=False, indent=2)
+    if args.umbral_p95 is not None and resultado["latencia_s"]["p95"] > args.umbral_p95:
+        print(f"❌ p95 {resultado['latencia_s']['p95']:.4f} s supera el umbral {args.umbral_p95} s")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,141 @@
+"""Prueba de carga: throughput por worker de gunicorn con workers sync contra gevent.
+
+Levanta gunicorn de verdad (con gunicorn.conf.py) sobre una app cuyo Gemini,
+Postgres y Twilio son los dobles de benchmark.py, con la latencia de modelo
+indicada, y le manda peticiones concurrentes a /chat por HTTP. Con un worker
+sync cada consulta ocupa el proceso entero mientras "espera a Gemini"; con
+gevent el mismo proceso atiende muchas a la vez.
+
+    python benchmark_carga.py
+    python benchmark_carga.py --clases sync,gevent --peticiones 400 --concurrencia 50 --latencia-modelo 0.5
+"""
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import subprocess
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmark import percentil
+
+DIRECTORIO = os.path.dirname(os.path.abspath(__file__))
+
+
+def crear_app_simulada():
+    """Fábrica para gunicorn ('benchmark_carga:crear_app_simulada()'): la app con dobles."""
+    import benchmark
+    import bot_core
+    from cache_respuestas import cache
+
+    opciones = argparse.Namespace(
+        latencia_modelo=float(os.environ.get("CARGA_LATENCIA_MODELO", "0.2")),
+        variacion_modelo=0.0, semilla=1234, latencia_db=0.0, latencia_twilio=0.0)
+    benchmark.instalar_dobles(bot_core, opciones)
+    bot_core.limitador = benchmark.SinLimite()
+    # Cada petición tiene que llegar al "modelo".
+    cache.max_entradas = 0
+    return bot_core.app
+
+
+def _puerto_libre():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _esperar_listo(url, proceso, timeout=60):
+    limite = time.monotonic() + timeout
+    while time.monotonic() < limite:
+        if proceso.poll() is not None:
+            raise RuntimeError(f"gunicorn terminó con código {proceso.returncode}")
+        try:
+            with urllib.request.urlopen(url + "/healthz", timeout=1) as r:
+                if r.status == 200:
+                    return
+        except Exception:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError("gunicorn no quedó listo a tiempo")
+
+
+def _post(url, i):
+    cuerpo = json.dumps({"mensaje": f"Tengo una consulta de salud número {i}"}).encode("utf-8")
+    peticion = urllib.request.Request(url + "/chat", data=cuerpo, headers={"Content-Type": "application/json"})
+    inicio = time.perf_counter()
+    with urllib.request.urlopen(peticion, timeout=300) as r:
+        r.read()
+        ok = r.status == 200
+    return time.perf_counter() - inicio, ok
+
+
+def medir(clase, args):
+    puerto = _puerto_libre()
+    url = f"http://127.0.0.1:{puerto}"
+    # La clase va por GUNICORN_WORKER_CLASS para que gunicorn.conf.py (psycogreen) la vea.
+    entorno = dict(os.environ, CARGA_LATENCIA_MODELO=str(args.latencia_modelo), GUNICORN_WORKER_CLASS=clase)
+    comando = [sys.executable, "-m", "gunicorn", "benchmark_carga:crear_app_simulada()",
+               "--bind", f"127.0.0.1:{puerto}", "--workers", str(args.trabajadores),
+               "--worker-connections", str(max(args.concurrencia * 2, 100)), "--log-level", "warning"]
+    proceso = subprocess.Popen(comando, cwd=DIRECTORIO, env=entorno,
+                               stdout=subprocess.DEVNULL, stderr=None if args.verbose else subprocess.DEVNULL)
+    try:
+        _esperar_listo(url, proceso)
+        inicio = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrencia) as ejecutor:
+            resultados = list(ejecutor.map(lambda i: _post(url, i), range(args.peticiones)))
+        duracion = time.perf_counter() - inicio
+    finally:
+        proceso.terminate()
+        proceso.wait(timeout=30)
+
+    latencias = [d for d, _ in resultados]
+    throughput = len(resultados) / duracion
+    return {
+        "clase": clase,
+        "trabajadores": args.trabajadores,
+        "peticiones": len(resultados),
+        "errores": sum(not ok for _, ok in resultados),
+        "duracion_s": round(duracion, 3),
+        "throughput_rps": round(throughput, 2),
+        "rps_por_worker": round(throughput / args.trabajadores, 2),
+        "latencia_s": {
+            "p50": round(percentil(latencias, 0.5), 4),
+            "p95": round(percentil(latencias, 0.95), 4),
+            "p99": round(percentil(latencias, 0.99), 4),
+        },
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clases", default="sync,gevent", help="clases de worker de gunicorn a comparar")
+    parser.add_argument("--trabajadores", type=int, default=1, help="workers de gunicorn por corrida")
+    parser.add_argument("--peticiones", type=int, default=200)
+    parser.add_argument("--concurrencia", type=int, default=40)
+    parser.add_argument("--latencia-modelo", type=float, default=0.2)
+    parser.add_argument("--json", help="guardar el resultado en este archivo")
+    parser.add_argument("--verbose", action="store_true", help="mostrar la salida de error de gunicorn")
+    args = parser.parse_args(argv)
+
+    print(f"{args.peticiones} peticiones, concurrencia {args.concurrencia}, "
+          f"Gemini simulado de {args.latencia_modelo * 1000:.0f} ms, {args.trabajadores} worker(s)")
+    print(f"{'clase':<10}{'req/s':>9}{'req/s/worker':>14}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'errores':>9}")
+    resultados = []
+    for clase in args.clases.split(","):
+        r = medir(clase, args)
+        resultados.append(r)
+        lat = r["latencia_s"]
+        print(f"{clase:<10}{r['throughput_rps']:>9.1f}{r['rps_por_worker']:>14.1f}{lat['p50'] * 1000:>10.0f}"
+              f"{lat['p95'] * 1000:>10.0f}{lat['p99'] * 1000:>10.0f}{r['errores']:>9}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(resultados, f, ensure_ascii=False, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
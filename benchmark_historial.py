@@ -0,0 +1,132 @@
+"""Benchmark del historial: una conexión por INSERT (camino anterior) contra pool + escritor en lotes.
+
+Necesita un Postgres con la tabla historial_consultas en DATABASE_URL (para uno
+local sin SSL agrega DB_SSLMODE=disable). Sin DATABASE_URL, o si la DB no
+responde, se omite y sale con código 0. Las filas usan un celular propio de la
+corrida y se borran al terminar.
+
+    DATABASE_URL=postgresql://postgres@localhost/cuerpo_fiel_db DB_SSLMODE=disable python benchmark_historial.py
+    python benchmark_historial.py --filas 5000 --concurrencia 32 --json historial.json
+"""
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmark import percentil
+
+
+def insertar_con_conexion_propia(parametros, celular, mensaje, respuesta):
+    """El guardar_historial original: conectar, insertar, commit y cerrar en cada consulta."""
+    import psycopg2
+    conn = psycopg2.connect(**parametros)
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("INSERT INTO historial_consultas (celular, mensaje_recibido, respuesta_dada) "
+                           "VALUES (%s, %s, %s)", (celular, mensaje, respuesta))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def correr(llamada, filas, concurrencia, celular):
+    """Ejecuta `filas` llamadas en paralelo; devuelve las latencias por llamada."""
+    latencias = []
+    lock = threading.Lock()
+
+    def una(i):
+        inicio = time.perf_counter()
+        llamada(celular, f"mensaje de prueba {i}", f"respuesta de prueba {i} " + "x" * 400)
+        duracion = time.perf_counter() - inicio
+        with lock:
+            latencias.append(duracion)
+
+    with ThreadPoolExecutor(max_workers=concurrencia) as ejecutor:
+        list(ejecutor.map(una, range(filas)))
+    return latencias
+
+
+def contar_y_borrar(celular):
+    import persistencia
+    with persistencia.conexion() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("DELETE FROM historial_consultas WHERE celular = %s", (celular,))
+            return cursor.rowcount
+
+
+def resultado(nombre, latencias, duracion, escritas):
+    return {
+        "camino": nombre,
+        "filas": len(latencias),
+        "escritas": escritas,
+        "duracion_s": round(duracion, 4),
+        "inserts_por_s": round(escritas / duracion, 1),
+        "latencia_ms": {
+            "p50": round(percentil(latencias, 0.5) * 1000, 3),
+            "p95": round(percentil(latencias, 0.95) * 1000, 3),
+            "p99": round(percentil(latencias, 0.99) * 1000, 3),
+        },
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--filas", type=int, default=1000)
+    parser.add_argument("--concurrencia", type=int, default=16)
+    parser.add_argument("--json", help="guardar el resultado en este archivo")
+    args = parser.parse_args(argv)
+
+    if not os.environ.get("DATABASE_URL"):
+        print("DATABASE_URL no está definida: se omite el benchmark del historial.")
+        return 0
+
+    import metricas  # noqa: F401  (configura el logger antes de silenciarlo)
+    logging.getLogger("cuerpofiel").setLevel(logging.CRITICAL)
+    import persistencia
+
+    parametros = persistencia.parametros_conexion()
+    try:
+        contar_y_borrar("benchmark-sondeo")
+    except Exception as e:
+        print(f"La base de datos no responde ({e}): se omite el benchmark del historial.")
+        return 0
+
+    celular = f"benchmark-{os.getpid()}"
+    resultados = []
+    try:
+        # Camino anterior: la latencia de la petición incluye conectar + INSERT + commit.
+        inicio = time.perf_counter()
+        latencias = correr(lambda c, m, r: insertar_con_conexion_propia(parametros, c, m, r),
+                           args.filas, args.concurrencia, celular)
+        duracion = time.perf_counter() - inicio
+        resultados.append(resultado("conexion_por_insert", latencias, duracion, contar_y_borrar(celular)))
+
+        # Camino actual: la petición solo encola; el throughput cuenta hasta vaciar la cola.
+        inicio = time.perf_counter()
+        latencias = correr(persistencia.encolar_historial, args.filas, args.concurrencia, celular)
+        persistencia.escritor.detener(timeout=120)
+        duracion = time.perf_counter() - inicio
+        resultados.append(resultado("escritor_en_lotes", latencias, duracion, contar_y_borrar(celular)))
+    finally:
+        contar_y_borrar(celular)
+        persistencia.cerrar_pool()
+
+    print(f"{args.filas} filas, concurrencia {args.concurrencia}")
+    print(f"{'camino':<22}{'escritas':>9}{'inserts/s':>11}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for r in resultados:
+        lat = r["latencia_ms"]
+        print(f"{r['camino']:<22}{r['escritas']:>9}{r['inserts_por_s']:>11.1f}"
+              f"{lat['p50']:>10.3f}{lat['p95']:>10.3f}{lat['p99']:>10.3f}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(resultados, f, ensure_ascii=False, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
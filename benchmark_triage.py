@@ -0,0 +1,82 @@
+"""Microbenchmark del triage: µs por mensaje según el tamaño de la lista de palabras clave.
+
+Agrega palabras clave sintéticas (reproducibles con --semilla) a las de
+palabras_emergencia.json hasta multiplicar la lista por cada escala y mide
+Triage.buscar sobre el corpus, con coincidencia exacta y con la difusa.
+
+    python benchmark_triage.py
+    python benchmark_triage.py --escalas 1,10,100,1000 --corpus mensajes.jsonl --json triage.json
+"""
+import sys
+import json
+import time
+import random
+import logging
+import argparse
+
+from benchmark import cargar_corpus
+
+SILABAS = ("CA", "DO", "LOR", "PE", "CHO", "SAN", "GRA", "DO", "TOS", "FIE", "BRE", "MA", "REO", "VO", "MI",
+           "TO", "ES", "TRE", "NI", "MIEN", "TO", "CRI", "SIS", "AR", "DOR", "PUL", "MON", "CO", "RA", "ZON")
+
+
+def palabras_sinteticas(cantidad, azar):
+    """Palabras y frases inventadas que comparten prefijos, como las reales."""
+    generadas = set()
+    while len(generadas) < cantidad:
+        palabras = ["".join(azar.choice(SILABAS) for _ in range(azar.randint(2, 4)))
+                    for _ in range(azar.choice((1, 1, 2, 3)))]
+        generadas.add(" ".join(palabras))
+    return sorted(generadas)
+
+
+def medir(triage, corpus, repeticiones):
+    """Mejor tiempo por mensaje (µs) de varias pasadas sobre el corpus."""
+    mejor = float("inf")
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        for mensaje in corpus:
+            triage.buscar(mensaje)
+        mejor = min(mejor, time.perf_counter() - inicio)
+    return mejor / len(corpus) * 1e6
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", help="JSONL o texto plano; por defecto el corpus de benchmark.py")
+    parser.add_argument("--escalas", default="1,10,100", help="múltiplos del tamaño de la lista real")
+    parser.add_argument("--repeticiones", type=int, default=20)
+    parser.add_argument("--semilla", type=int, default=1234)
+    parser.add_argument("--json", help="guardar el resultado en este archivo")
+    args = parser.parse_args(argv)
+
+    import metricas  # noqa: F401  (configura el logger antes de silenciarlo)
+    logging.getLogger("cuerpofiel").setLevel(logging.WARNING)
+    from triage import Triage, cargar_palabras
+
+    palabras, no_corregir, flexionables = cargar_palabras()
+    corpus = cargar_corpus(args.corpus)
+    if not corpus:
+        sys.exit("El corpus está vacío")
+    sinteticas = palabras_sinteticas(len(palabras) * max(int(e) for e in args.escalas.split(",")),
+                                     random.Random(args.semilla))
+
+    resultados = []
+    print(f"{len(corpus)} mensajes, {len(palabras)} palabras clave reales")
+    print(f"{'escala':>7}{'palabras':>10}{'exacto µs':>12}{'difuso µs':>12}")
+    for escala in (int(e) for e in args.escalas.split(",")):
+        lista = palabras + sinteticas[:len(palabras) * (escala - 1)]
+        exacto = medir(Triage(lista, distancia_max=0, no_corregir=no_corregir, flexionables=flexionables), corpus, args.repeticiones)
+        difuso = medir(Triage(lista, distancia_max=1, no_corregir=no_corregir, flexionables=flexionables), corpus, args.repeticiones)
+        resultados.append({"escala": escala, "palabras": len(lista), "exacto_us": round(exacto, 2),
+                           "difuso_us": round(difuso, 2)})
+        print(f"{escala:>7}{len(lista):>10}{exacto:>12.2f}{difuso:>12.2f}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(resultados, f, ensure_ascii=False, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,23 +1,62 @@
 import os
-import psycopg2
-import google.generativeai as genai
-from flask import Flask, request, jsonify, render_template
+import json
+import queue
+import threading
+from collections import Counter
+from contextlib import contextmanager
 
-app = Flask(__name__)
+import time
+
+from flask import Blueprint, Flask, Response, g, request, jsonify, render_template, stream_with_context
+
+import persistencia
+from cache_respuestas import cache
+from triage import triage
+from memoria import memoria, estimar_tokens
+from cola_whatsapp import ColaWhatsApp, WHATSAPP_MODO_ASINCRONO
+from limites import Coalescedor, crear_limitador
+import metricas
+from metricas import cronometro, evento, advertencia, error, incrementar
 
 # ==========================================
 # 1. CONFIGURACIÓN DE GEMINI (CEREBRO)
 # ==========================================
 API_KEY = os.environ.get("GEMINI_API_KEY") 
+NOMBRE_MODELO = 'gemini-2.5-flash-lite-preview-09-2025'
+
+# Se construyen al primer uso (o en calentar()): importar google.generativeai
+# cuesta ~1 s y no debe pagarse al importar este módulo.
+# `model` lleva la persona del Dr. Lucas en system_instruction (se configura una
+# sola vez, no se concatena en cada mensaje); `modelo_resumen` es neutro y se
+# usa para condensar la memoria.
+model = None
+modelo_resumen = None
+_modelo_lock = threading.Lock()
+
+
+def _configurar_modelos():
+    global model, modelo_resumen
+    with _modelo_lock:
+        if model is None:
+            import google.generativeai as genai
+            if not API_KEY:
+                advertencia("gemini_sin_clave")
+            # Transporte REST: con workers gevent la llamada cede el control en vez de bloquear el proceso.
+            genai.configure(api_key=API_KEY, transport=os.environ.get("GEMINI_TRANSPORT", "rest"))
+            modelo_resumen = genai.GenerativeModel(NOMBRE_MODELO)
+            model = genai.GenerativeModel(NOMBRE_MODELO, system_instruction=INSTRUCCION_SISTEMA)
+
+
+def obtener_modelo():
+    if model is None:
+        _configurar_modelos()
+    return model
+
 
-try:
-    if not API_KEY:
-        print("⚠️ Advertencia: Clave de Gemini no encontrada en el entorno.")
-        
-    genai.configure(api_key=API_KEY)
-    model = genai.GenerativeModel('gemini-2.5-flash-lite-preview-09-2025') 
-except Exception as e:
-    print(f"❌ Error al configurar Gemini: {e}")
+def obtener_modelo_resumen():
+    if modelo_resumen is None:
+        _configurar_modelos()
+    return modelo_resumen
 
 # INSTRUCCIÓN MAESTRA (LA PERSONALIDAD NATURISTA, DIRECTOR DE MINISTERIO Y TRIAGE CONVERSACIONAL)
 INSTRUCCION_SISTEMA = """
@@ -38,99 +77,515 @@ REGLAS DE RESPUESTA Y JUICIO EXPERTO (Flujo Humano):
 6. CIERRE: Finaliza SIEMPRE con un versículo bíblico de esperanza.
 """
 
-# --- LISTA DE PALABRAS CLAVE DE EMERGENCIA (Se mantiene el chequeo de seguridad) ---
-EMERGENCY_KEYWORDS = ["INFARTO", "SANGRADO PROFUSO", "PÉRDIDA DE CONCIENCIA", "DOLOR INTENSO DE PECHO", "HEMORRAGIA", "PARO CARDÍACO", "AMBULANCIA", "911", "ACCIDENTE GRAVE", "VENENO", "ASFIXIA", "PEOR DOLOR DE MI VIDA"]
+# --- PALABRAS CLAVE DE EMERGENCIA: viven en palabras_emergencia.json (ver triage.py) ---
 
 # ==========================================
-# 2. BASE DE DATOS Y MEMORIA (Sin cambios)
+# 2. BASE DE DATOS Y MEMORIA
 # ==========================================
-def obtener_conexion():
+def guardar_historial(celular, mensaje, respuesta, con_memoria=False):
+    # No bloquea la respuesta: el escritor de persistencia.py inserta en lotes.
+    persistencia.encolar_historial(celular, mensaje, respuesta)
+    # La memoria en proceso solo aplica a números identificables (no al cliente web).
+    if con_memoria and respuesta not in (MENSAJE_ERROR, MENSAJE_SATURADO):
+        memoria.registrar(celular, mensaje, respuesta)
+
+# ==========================================
+# 3. CONTROL DE CONCURRENCIA (COLA Y CONTRAPRESIÓN)
+# ==========================================
+# Límite de llamadas simultáneas a Gemini por worker. Las que exceden el
+# límite esperan hasta ESPERA_MAXIMA_COLA segundos; si ya hay demasiadas en
+# espera se rechazan de inmediato con un mensaje de saturación.
+MAX_CONSULTAS_SIMULTANEAS = int(os.environ.get("MAX_CONSULTAS_SIMULTANEAS", "50"))
+MAX_EN_ESPERA = int(os.environ.get("MAX_EN_ESPERA", "100"))
+ESPERA_MAXIMA_COLA = float(os.environ.get("ESPERA_MAXIMA_COLA", "10"))
+
+MENSAJE_ERROR = "⚠️ Lo siento, Dr. Lucas está en una consulta crítica. Intenta de nuevo en un momento."
+MENSAJE_SATURADO = "⏳ Dr. Lucas está atendiendo a muchos pacientes en este momento. Intenta de nuevo en unos segundos."
+
+_cupos_modelo = threading.BoundedSemaphore(MAX_CONSULTAS_SIMULTANEAS)
+_en_espera = 0
+_en_espera_lock = threading.Lock()
+
+
+class SaturacionError(Exception):
+    pass
+
+
+@contextmanager
+def cupo_modelo():
+    global _en_espera
+    with _en_espera_lock:
+        if _en_espera >= MAX_EN_ESPERA:
+            raise SaturacionError()
+        _en_espera += 1
     try:
-        database_url = os.environ.get('DATABASE_URL')
-        if database_url:
-            return psycopg2.connect(database_url, sslmode='require')
-        return psycopg2.connect(user="root", password="root", host="localhost", port="5432", database="cuerpo_fiel_db")
-    except Exception:
-        return None
-
-def guardar_historial(celular, mensaje, respuesta):
-    conn = obtener_conexion()
-    if conn:
-        try:
-            cursor = conn.cursor()
-            cursor.execute("INSERT INTO historial_consultas (celular, mensaje_recibido, respuesta_dada) VALUES (%s, %s, %s)", (celular, mensaje, respuesta))
-            conn.commit()
-            cursor.close()
-            conn.close()
-        except Exception as e:
-            print(f"❌ Error al guardar en DB: {e}")
-            pass
+        with cronometro('espera_cupo'):
+            obtenido = _cupos_modelo.acquire(timeout=ESPERA_MAXIMA_COLA)
+    finally:
+        with _en_espera_lock:
+            _en_espera -= 1
+    if not obtenido:
+        raise SaturacionError()
+    try:
+        yield
+    finally:
+        _cupos_modelo.release()
+
+
+# --- 4. CEREBRO DE LA APLICACIÓN (LÓGICA CON FLUJO DIRECTO) ---
+RESPUESTA_EMERGENCIA = (
+    "🔴 *ALERTA ROJA: DETENTE INMEDIATAMENTE* 🔴\n"
+    "El síntoma que describes es una **emergencia médica grave**. Por favor, deja de chatear AHORA y llama de inmediato a los servicios de urgencias (911/número local) o acude a la sala de emergencias más cercana. Tu vida es la prioridad.\n\n"
+    "🙏 *Promesa Bíblica:* 'Encomienda a Jehová tu camino, y confía en él; y él hará.' (Salmos 37:5). **Busca ayuda profesional sin demora.**"
+)
+
 
-# --- 3. CEREBRO DE LA APLICACIÓN (LÓGICA CON FLUJO DIRECTO) ---
-def consultar_gemini(mensaje_usuario):
+def es_emergencia(mensaje_usuario):
+    with cronometro('triage'):
+        palabra = triage.buscar(mensaje_usuario)
+    if palabra:
+        incrementar('emergencias_total')
+        evento('emergencia_detectada', palabra=palabra)
+    return palabra is not None
+
+
+def es_saludo_inicial(mensaje_usuario):
+    # Check para activar la presentación de primer contacto
+    # Si el mensaje es corto (menos de 4 palabras) Y es un saludo, forzamos la introducción.
     mensaje_upper = mensaje_usuario.upper()
-    
+    return len(mensaje_usuario.split()) < 4 and any(word in mensaje_upper for word in ["HOLA", "BUENOS", "SALUDO"])
+
+
+# --- PLANTILLAS DE PROMPT (la persona ya va en system_instruction) ---
+PLANTILLAS_PROMPT = {
+    # Si solo saluda, agregamos la instrucción de presentación antes de la pregunta
+    'saludo': (
+        "INSTRUCCIÓN EXTRA: Aplica la REGLA 1 de tu ROL y haz la presentación formal, pregunta el nombre y el estado, y luego ofrece ayuda."
+        "\n\nPregunta del paciente: {mensaje}"
+    ),
+    # Si no es saludo, la IA irá directo al diagnóstico (REGLA 2)
+    'consulta': "Pregunta del paciente: {mensaje}",
+}
+TOKENS_SISTEMA = estimar_tokens(INSTRUCCION_SISTEMA)
+
+# Tokens estimados enviados por variante (mensaje + historial; sin la instrucción de sistema).
+tokens_enviados = Counter()
+_tokens_lock = threading.Lock()
+
+
+@cronometro('prompt')
+def construir_prompt(mensaje_usuario, variante, historial=()):
+    prompt = PLANTILLAS_PROMPT[variante].format(mensaje=mensaje_usuario)
+    tokens = estimar_tokens(prompt) + sum(estimar_tokens(p) for turno in historial for p in turno['parts'])
+    with _tokens_lock:
+        tokens_enviados[variante] += tokens
+        tokens_enviados[f'consultas_{variante}'] += 1
+    return prompt
+
+
+def limpiar_formato(texto):
+    return texto.replace('**', '*').replace('__', '_')
+
+
+def resumir_conversacion(resumen_previo, turnos):
+    """Resumidor de memoria.py: condensa turnos viejos en un resumen acumulado."""
+    conversacion = "\n".join(f"Paciente: {m}\nDr. Lucas: {r}" for m, r in turnos)
+    prompt = (
+        "Resume en un máximo de 120 palabras los datos de salud relevantes del paciente "
+        "(nombre, síntomas, condiciones, recomendaciones dadas). Integra el resumen previo.\n\n"
+        f"Resumen previo: {resumen_previo or 'ninguno'}\n\nConversación:\n{conversacion}"
+    )
+    with cupo_modelo():
+        return obtener_modelo_resumen().generate_content(prompt).text
+
+
+memoria.resumidor = resumir_conversacion
+
+
+def preparar_consulta(mensaje_usuario, celular=None):
+    """Devuelve (respuesta_inmediata, variante, historial).
+
+    respuesta_inmediata no es None si es una emergencia o un acierto de caché.
+    """
     # === 1. TRIAGE DE EMERGENCIA (ALERTA ROJA INMEDIATA) ===
-    if any(keyword in mensaje_upper for keyword in EMERGENCY_KEYWORDS):
-        return (
-            "🔴 *ALERTA ROJA: DETENTE INMEDIATAMENTE* 🔴\n"
-            "El síntoma que describes es una **emergencia médica grave**. Por favor, deja de chatear AHORA y llama de inmediato a los servicios de urgencias (911/número local) o acude a la sala de emergencias más cercana. Tu vida es la prioridad.\n\n"
-            "🙏 *Promesa Bíblica:* 'Encomienda a Jehová tu camino, y confía en él; y él hará.' (Salmos 37:5). **Busca ayuda profesional sin demora.**"
-        )
-
-    # === 2. LÓGICA CONVERSACIONAL Y JUICIO ===
+    if es_emergencia(mensaje_usuario):
+        return RESPUESTA_EMERGENCIA, None, None
+
+    variante = 'saludo' if es_saludo_inicial(mensaje_usuario) else 'consulta'
+    historial = []
+    if celular:
+        with cronometro('memoria'):
+            historial = memoria.historial_para_prompt(celular)
+
+    # === 2. CACHÉ DE RESPUESTAS (las emergencias nunca llegan aquí) ===
+    # Solo sin contexto previo: una respuesta que depende de la conversación no es reutilizable.
+    if not historial:
+        with cronometro('cache'):
+            cache.validar(INSTRUCCION_SISTEMA, NOMBRE_MODELO)
+            texto = cache.obtener(variante, mensaje_usuario)
+        incrementar('cache_consultas_total', resultado='fallo' if texto is None else 'acierto')
+        if texto is not None:
+            return texto, variante, historial
+
+    return None, variante, historial
+
+
+def consultar_gemini(mensaje_usuario, celular=None):
+    inmediata, variante, historial = preparar_consulta(mensaje_usuario, celular)
+    if inmediata is not None:
+        return inmediata
+
+    # === 3. LÓGICA CONVERSACIONAL Y JUICIO ===
     try:
-        # Check para activar la presentación de primer contacto
-        # Si el mensaje es corto (menos de 4 palabras) Y es un saludo, forzamos la introducción.
-        is_initial_greeting = len(mensaje_usuario.split()) < 4 and any(word in mensaje_upper for word in ["HOLA", "BUENOS", "SALUDO"])
-        
-        # El prompt base es el cuerpo del mensaje.
-        prompt_full = f"{INSTRUCCION_SISTEMA}\n\nPregunta del paciente: {mensaje_usuario}"
-
-        if is_initial_greeting:
-            # Si solo saluda, agregamos la instrucción de presentación al inicio del prompt
-            presentacion_protocolo = "INSTRUCCIÓN EXTRA: Aplica la REGLA 1 de tu ROL y haz la presentación formal, pregunta el nombre y el estado, y luego ofrece ayuda."
-            prompt_full = f"{INSTRUCCION_SISTEMA}\n{presentacion_protocolo}\n\nPregunta del paciente: {mensaje_usuario}"
-        
-        # Si no es saludo, la IA irá directo al diagnóstico (REGLA 2)
-        
-        chat = model.start_chat(history=[])
-        response = chat.send_message(prompt_full)
-        
+        prompt_full = construir_prompt(mensaje_usuario, variante, historial)
+        with cupo_modelo(), cronometro('gemini'):
+            chat = obtener_modelo().start_chat(history=historial)
+            response = chat.send_message(prompt_full)
+
         # Limpieza de formato y retorno
-        texto = response.text.replace('**', '*').replace('__', '_')
+        with cronometro('limpieza'):
+            texto = limpiar_formato(response.text)
+        if not historial:
+            cache.guardar(variante, mensaje_usuario, texto)
         return texto
+    except SaturacionError:
+        incrementar('saturacion_total')
+        advertencia('gemini_saturado')
+        return MENSAJE_SATURADO
     except Exception as e:
-        print(f"❌ ERROR CRÍTICO DE GOOGLE: {e}")
-        return "⚠️ Lo siento, Dr. Lucas está en una consulta crítica. Intenta de nuevo en un momento."
+        incrementar('errores_modelo_total')
+        error('gemini_error', detalle=str(e))
+        return MENSAJE_ERROR
+
+
+def consultar_gemini_stream(mensaje_usuario, celular=None, al_terminar=None):
+    """Igual que consultar_gemini, pero entrega la respuesta en fragmentos.
+
+    `al_terminar(texto)` recibe la respuesta completa cuando el modelo termina,
+    aunque el cliente ya no esté leyendo.
+    """
+    inmediata, variante, historial = preparar_consulta(mensaje_usuario, celular)
+    if inmediata is not None:
+        if al_terminar is not None:
+            al_terminar(inmediata)
+        yield inmediata
+        return
+
+    # Gemini se lee en otro hilo: el cupo se libera cuando el modelo termina, no
+    # cuando un cliente lento termina de recibir los fragmentos.
+    salida = queue.Queue()
+    threading.Thread(target=_leer_stream, args=(mensaje_usuario, variante, historial, salida, al_terminar),
+                     name="gemini-stream", daemon=True).start()
+    while True:
+        fragmento = salida.get()
+        if fragmento is _FIN_STREAM:
+            return
+        yield fragmento
+
+
+_FIN_STREAM = object()
+
+
+def _leer_stream(mensaje_usuario, variante, historial, salida, al_terminar=None):
+    partes = []
+
+    def enviar(texto):
+        partes.append(texto)
+        salida.put(texto)
+
+    try:
+        prompt_full = construir_prompt(mensaje_usuario, variante, historial)
+        with cupo_modelo(), cronometro('gemini_stream'):
+            inicio = time.perf_counter()
+            chat = obtener_modelo().start_chat(history=historial)
+            response = chat.send_message(prompt_full, stream=True)
+            pendiente = ''
+            for fragmento in response:
+                if inicio is not None:
+                    metricas.observar('etapa_segundos', time.perf_counter() - inicio, etapa='gemini_primer_fragmento')
+                    inicio = None
+                texto = pendiente + fragmento.text
+                # Un '**' puede quedar partido entre dos fragmentos: se retienen los '*'/'_' finales.
+                cuerpo = texto.rstrip('*_')
+                pendiente = texto[len(cuerpo):]
+                texto = cuerpo
+                if texto:
+                    enviar(limpiar_formato(texto))
+            if pendiente:
+                enviar(limpiar_formato(pendiente))
+        if not historial:
+            cache.guardar(variante, mensaje_usuario, ''.join(partes))
+    except SaturacionError:
+        incrementar('saturacion_total')
+        advertencia('gemini_saturado')
+        enviar(MENSAJE_SATURADO)
+    except Exception as e:
+        incrementar('errores_modelo_total')
+        error('gemini_error', detalle=str(e))
+        enviar(MENSAJE_ERROR)
+    finally:
+        salida.put(_FIN_STREAM)
+        # Aquí y no en la ruta: si el cliente cierra la pestaña el generador de la
+        # respuesta se cierra en un yield y lo que venga después nunca corre.
+        if al_terminar is not None:
+            try:
+                al_terminar(''.join(partes))
+            except Exception as e:
+                error('stream_al_terminar_error', detalle=str(e))
+
+
+# ==========================================
+# 5. LÍMITE POR NÚMERO Y DUPLICADOS SIMULTÁNEOS
+# ==========================================
+MENSAJE_LIMITE = "⏳ Estás enviando mensajes muy rápido. Espera unos segundos y vuelve a escribir."
+
+limitador = crear_limitador()
+coalescedor = Coalescedor()
+
+
+def clave_limite(celular):
+    if request.values.get('From'):
+        return celular
+    # Cliente web: no hay número; se usa la IP real. El router de Heroku agrega la IP que
+    # se conectó al FINAL de X-Forwarded-For; lo anterior lo manda el cliente y se puede falsear.
+    reenviada = request.headers.get('X-Forwarded-For', '')
+    return reenviada.split(',')[-1].strip() or request.remote_addr or 'web'
+
+
+def responder(celular, mensaje, con_memoria, clave=None):
+    """Consulta + historial; duplicados simultáneos comparten una llamada y una fila.
+
+    `clave` identifica al remitente (la de clave_limite); por defecto el número.
+    Devuelve (respuesta, es_lider).
+    """
+    def consultar():
+        respuesta = consultar_gemini(mensaje, celular if con_memoria else None)
+        with cronometro('historial'):
+            guardar_historial(celular, mensaje, respuesta, con_memoria)
+        return respuesta
+    # Todos los clientes web comparten celular 'Web User': sin la IP se fundirían
+    # consultas iguales de personas distintas.
+    respuesta, lider = coalescedor.ejecutar((clave or celular, mensaje), consultar)
+    if not lider:
+        incrementar('coalescidas_total')
+    return respuesta, lider
+
+
+# ==========================================
+# 6. WHATSAPP ASÍNCRONO (WEBHOOK CON ACUSE INMEDIATO)
+# ==========================================
+TWILIO_AUTH_TOKEN = os.environ.get("TWILIO_AUTH_TOKEN")
+RESPUESTA_TWIML_VACIA = '<?xml version="1.0" encoding="UTF-8"?><Response />'
+
+
+def firma_twilio_valida():
+    if not TWILIO_AUTH_TOKEN:
+        return True
+    from twilio.request_validator import RequestValidator
+    # Detrás del router de Heroku la app ve http://; Twilio firmó la URL pública.
+    url = request.url
+    proto = request.headers.get('X-Forwarded-Proto')
+    if proto:
+        url = proto + url[url.index(':'):]
+    return RequestValidator(TWILIO_AUTH_TOKEN).validate(url, request.form, request.headers.get('X-Twilio-Signature', ''))
+
+
+def atender_whatsapp(celular, mensaje):
+    respuesta, _ = responder(celular, mensaje, con_memoria=True)
+    return respuesta
+
+
+cola_mensajes = ColaWhatsApp(atender_whatsapp)
+
+
+# ==========================================
+# 7. CALENTAMIENTO DEL WORKER
+# ==========================================
+# gunicorn.conf.py llama a calentar() antes de que el worker acepte tráfico:
+# así el primer usuario tras un arranque en frío no paga las importaciones,
+# la configuración de Gemini ni la apertura del pool de DB.
+_listo = threading.Event()
+_calentamiento_iniciado = False
+_calentamiento_lock = threading.Lock()
+estado_calentamiento = {}
+
+
+def calentar():
+    global _calentamiento_iniciado
+    with _calentamiento_lock:
+        if _calentamiento_iniciado:
+            return
+        _calentamiento_iniciado = True
+
+    pasos = [
+        ('modelo', obtener_modelo),
+        ('db', _calentar_db),
+        ('twilio', _importar_twilio),
+    ]
+    for nombre, paso in pasos:
+        try:
+            paso()
+            estado_calentamiento[nombre] = 'ok'
+        except Exception as e:
+            # Un componente caído no impide atender: se informa en /healthz.
+            estado_calentamiento[nombre] = f'error: {e}'
+            error('calentamiento_error', componente=nombre, detalle=str(e))
+    _listo.set()
+    evento('worker_listo', componentes=estado_calentamiento)
+
+
+def _calentar_db():
+    # El esquema lo crea migrar.py en la fase release, no cada worker al arrancar.
+    if persistencia.obtener_pool() is None:
+        raise RuntimeError("pool no disponible")
+
+
+def _importar_twilio():
+    from twilio.twiml.messaging_response import MessagingResponse  # noqa: F401
+    if WHATSAPP_MODO_ASINCRONO:
+        from twilio.request_validator import RequestValidator  # noqa: F401
+        from twilio.rest import Client  # noqa: F401
 
 
 # ==========================================
-# 4. RUTAS WEB Y DE WHATSAPP (Sin cambios)
+# 8. RUTAS WEB Y DE WHATSAPP
 # ==========================================
-@app.route('/')
+rutas = Blueprint('rutas', __name__)
+
+
+@rutas.route('/healthz')
+def healthz():
+    if not _listo.is_set():
+        # Sin el hook de gunicorn (p. ej. otro servidor) el primer sondeo inicia el calentamiento.
+        if not _calentamiento_iniciado:
+            threading.Thread(target=calentar, name="calentamiento", daemon=True).start()
+        return jsonify({"listo": False}), 503
+    return jsonify({"listo": True, "componentes": estado_calentamiento})
+
+@rutas.route('/')
 def home():
     return render_template('index.html')
 
-@app.route('/chat', methods=['POST'])
+@rutas.route('/chat', methods=['POST'])
 def chat():
     celular = request.values.get('From', 'Web User').replace('whatsapp:', '')
-    mensaje_in = request.values.get('Body', '') or request.get_json(silent=True).get('mensaje', '')
+    mensaje_in = request.values.get('Body', '') or (request.get_json(silent=True) or {}).get('mensaje', '')
     
-    print(f"📩 Recibido de {celular}: {mensaje_in}")
-
-    respuesta = consultar_gemini(mensaje_in)
+    con_memoria = bool(request.values.get('From'))
     
-    guardar_historial(celular, mensaje_in, respuesta)
+    es_whatsapp = 'whatsapp' in request.values.get('From', '').lower()
+    canal = 'whatsapp' if es_whatsapp else ('web' if not con_memoria else 'otro')
+    incrementar('mensajes_total', canal=canal)
+    evento('mensaje_recibido', canal=canal, celular=celular, mensaje=mensaje_in)
+
+    if es_whatsapp and WHATSAPP_MODO_ASINCRONO and not firma_twilio_valida():
+        incrementar('whatsapp_total', resultado='firma_invalida')
+        advertencia('twilio_firma_invalida', celular=celular)
+        return 'Firma inválida', 403
+
+    clave = clave_limite(celular)
+    if not limitador.permitir(clave):
+        incrementar('limite_excedido_total')
+        advertencia('limite_excedido', celular=celular)
+        return formatear_respuesta(MENSAJE_LIMITE, es_whatsapp)
 
-    if 'whatsapp' in request.values.get('From', '').lower():
-        from twilio.twiml.messaging_response import MessagingResponse
-        resp = MessagingResponse()
-        resp.message(respuesta)
-        return str(resp), 200, {'Content-Type': 'application/xml'}
+    if es_whatsapp and WHATSAPP_MODO_ASINCRONO:
+        estado = cola_mensajes.encolar(request.values.get('MessageSid'), celular, mensaje_in,
+                                       request.values.get('From'), request.values.get('To'))
+        incrementar('whatsapp_total', resultado=estado)
+        if estado != 'lleno':
+            # Reintentos de Twilio ('duplicado') también reciben el acuse vacío.
+            return RESPUESTA_TWIML_VACIA, 200, {'Content-Type': 'application/xml'}
+        advertencia('whatsapp_cola_llena', celular=celular)
+
+    respuesta, _ = responder(celular, mensaje_in, con_memoria, clave)
+
+    return formatear_respuesta(respuesta, es_whatsapp)
+
+def formatear_respuesta(respuesta, es_whatsapp):
+    if es_whatsapp:
+        with cronometro('twiml'):
+            from twilio.twiml.messaging_response import MessagingResponse
+            resp = MessagingResponse()
+            resp.message(respuesta)
+            xml = str(resp)
+        return xml, 200, {'Content-Type': 'application/xml'}
     else:
         return jsonify({"respuesta": respuesta})
 
+@rutas.route('/chat/stream', methods=['POST'])
+def chat_stream():
+    # Variante para el cliente web: Server-Sent Events con la respuesta en fragmentos.
+    celular = 'Web User'
+    mensaje_in = (request.get_json(silent=True) or {}).get('mensaje', '')
+
+    incrementar('mensajes_total', canal='web_stream')
+    evento('mensaje_recibido', canal='web_stream', celular=celular, mensaje=mensaje_in)
+
+    limitado = not limitador.permitir(clave_limite(celular))
+    if limitado:
+        incrementar('limite_excedido_total')
+        advertencia('limite_excedido', celular=celular)
+
+    def eventos():
+        if limitado:
+            yield f"data: {json.dumps({'texto': MENSAJE_LIMITE}, ensure_ascii=False)}\n\n"
+            yield "event: fin\ndata: {}\n\n"
+            return
+
+        def guardar(respuesta):
+            guardar_historial(celular, mensaje_in, respuesta)
+
+        for fragmento in consultar_gemini_stream(mensaje_in, al_terminar=guardar):
+            yield f"data: {json.dumps({'texto': fragmento}, ensure_ascii=False)}\n\n"
+        yield "event: fin\ndata: {}\n\n"
+
+    headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    return Response(stream_with_context(eventos()), mimetype='text/event-stream', headers=headers)
+
+@rutas.route('/cache/estadisticas')
+def estadisticas_cache():
+    return jsonify(cache.estadisticas())
+
+@rutas.route('/metrics')
+def metrics():
+    return Response(metricas.registro.exponer(), mimetype='text/plain; version=0.0.4')
+
+@rutas.route('/prompts/estadisticas')
+def estadisticas_prompts():
+    with _tokens_lock:
+        return jsonify({"tokens_sistema": TOKENS_SISTEMA, "tokens_enviados": dict(tokens_enviados)})
+
+
+def crear_app():
+    app = Flask(__name__)
+    app.register_blueprint(rutas)
+
+    @app.before_request
+    def _inicio_peticion():
+        g.inicio_peticion = time.perf_counter()
+
+    @app.after_request
+    def _fin_peticion(respuesta):
+        # En /chat/stream mide hasta el envío de cabeceras, no el fin del stream.
+        ruta = request.url_rule.rule if request.url_rule else 'desconocida'
+        metricas.observar('peticion_segundos', time.perf_counter() - g.inicio_peticion, ruta=ruta)
+        return respuesta
+
+    return app
+
+
+metricas.registro.medidor('cache_entradas', lambda: cache.estadisticas()['entradas'],
+                          'Respuestas guardadas en la caché.')
+metricas.registro.medidor('whatsapp_pendientes', cola_mensajes.pendientes,
+                          'Mensajes de WhatsApp esperando en la cola.')
+metricas.registro.medidor('historial_pendientes', persistencia.escritor.pendientes,
+                          'Filas de historial esperando al escritor en lotes.')
+
+
+app = crear_app()
+
 if __name__ == '__main__':
-    print("🚀 DR. LUCAS (FLUJO CONVERSACIONAL) - ACTIVO")
+    calentar()
+    evento('servidor_activo', modo='desarrollo')
     app.run(port=5000, debug=True)
\ No newline at end of file
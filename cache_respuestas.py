@@ -0,0 +1,243 @@
+import os
+import math
+import time
+import hashlib
+import threading
+import unicodedata
+from collections import OrderedDict, Counter
+
+from metricas import evento
+
+# ==========================================
+# CACHÉ DE RESPUESTAS (EXACTA + SIMILITUD OPCIONAL)
+# ==========================================
+# Nivel 1: coincidencia exacta sobre el texto normalizado (sin acentos,
+# minúsculas, sin puntuación). Nivel 2 (opcional): índice TF-IDF de
+# trigramas de caracteres con umbral de similitud coseno configurable.
+# Las entradas caducan por TTL, se desalojan por LRU y el total de bytes
+# está acotado. Cambiar la instrucción de sistema o el modelo vacía todo.
+
+CACHE_TTL = float(os.environ.get("CACHE_TTL", "86400"))
+CACHE_MAX_ENTRADAS = int(os.environ.get("CACHE_MAX_ENTRADAS", "1000"))
+CACHE_MAX_BYTES = int(os.environ.get("CACHE_MAX_BYTES", str(5 * 1024 * 1024)))
+# Vacío = nivel de similitud desactivado. Ejemplo razonable: 0.85. Los
+# trigramas no entienden el sentido: con 0.85 "no tengo dolor de cabeza"
+# puntúa 0.87 contra "tengo dolor de cabeza". Por eso un acierto similar
+# exige además las mismas negaciones (NEGACIONES) que la pregunta cacheada.
+CACHE_UMBRAL_SIMILITUD = os.environ.get("CACHE_UMBRAL_SIMILITUD", "")
+# Los vectores de los documentos se calculan con el IDF del momento y se
+# recalculan todos cuando el número de documentos se aleja más de esta
+# fracción del que había al calcularlos.
+CACHE_DERIVA_IDF = float(os.environ.get("CACHE_DERIVA_IDF", "0.1"))
+
+NEGACIONES = frozenset({"no", "nunca", "jamas", "sin", "ni", "tampoco", "nada", "nadie",
+                        "ningun", "ninguna", "ninguno", "not", "never", "without"})
+
+
+def normalizar(texto):
+    texto = unicodedata.normalize("NFKD", texto)
+    texto = "".join(c for c in texto if not unicodedata.combining(c)).lower()
+    texto = "".join(c if c.isalnum() else " " for c in texto)
+    return " ".join(texto.split())
+
+
+def _trigramas(texto):
+    grams = Counter()
+    for palabra in texto.split():
+        palabra = f" {palabra} "
+        for i in range(len(palabra) - 2):
+            grams[palabra[i:i + 3]] += 1
+    return grams
+
+
+def negaciones(texto):
+    """Palabras de negación de un texto ya normalizado."""
+    return NEGACIONES.intersection(texto.split())
+
+
+class IndiceSimilitud:
+    """Índice invertido de trigramas para búsqueda por coseno TF-IDF."""
+
+    def __init__(self, deriva_idf=CACHE_DERIVA_IDF):
+        self.deriva_idf = deriva_idf
+        self._docs = {}
+        self._postings = {}
+        self._vectores = {}  # clave -> (vector TF-IDF, norma), con el IDF de cuando se calculó
+        self._n_vectores = 0
+
+    def agregar(self, clave, texto):
+        if clave in self._docs:
+            return
+        grams = _trigramas(texto)
+        self._docs[clave] = grams
+        for g in grams:
+            self._postings.setdefault(g, set()).add(clave)
+        self._vectores[clave] = self._vector(grams)
+
+    def quitar(self, clave):
+        grams = self._docs.pop(clave, None)
+        self._vectores.pop(clave, None)
+        if not grams:
+            return
+        for g in grams:
+            claves = self._postings.get(g)
+            if claves is not None:
+                claves.discard(clave)
+                if not claves:
+                    del self._postings[g]
+
+    def limpiar(self):
+        self._docs.clear()
+        self._postings.clear()
+        self._vectores.clear()
+        self._n_vectores = 0
+
+    def _idf(self, gram):
+        return math.log((1 + len(self._docs)) / (1 + len(self._postings.get(gram, ())))) + 1
+
+    def _vector(self, grams):
+        vec = {g: tf * self._idf(g) for g, tf in grams.items()}
+        norma = math.sqrt(sum(v * v for v in vec.values())) or 1.0
+        return vec, norma
+
+    def _refrescar(self):
+        n = len(self._docs)
+        if abs(n - self._n_vectores) <= self.deriva_idf * self._n_vectores:
+            return
+        self._vectores = {clave: self._vector(grams) for clave, grams in self._docs.items()}
+        self._n_vectores = n
+
+    def buscar(self, texto, filtro=None):
+        """Devuelve (clave, similitud) del documento más parecido o (None, 0.0)."""
+        self._refrescar()
+        consulta, norma_q = self._vector(_trigramas(texto))
+        productos = {}
+        for g, peso in consulta.items():
+            for clave in self._postings.get(g, ()):
+                productos[clave] = productos.get(clave, 0.0) + peso * self._vectores[clave][0][g]
+
+        mejor, mejor_sim = None, 0.0
+        for clave, producto in productos.items():
+            if filtro is not None and not filtro(clave):
+                continue
+            sim = producto / (norma_q * self._vectores[clave][1])
+            if sim > mejor_sim:
+                mejor, mejor_sim = clave, sim
+        return mejor, mejor_sim
+
+
+class CacheRespuestas:
+
+    def __init__(self, ttl=CACHE_TTL, max_entradas=CACHE_MAX_ENTRADAS, max_bytes=CACHE_MAX_BYTES,
+                 umbral_similitud=None):
+        self.ttl = ttl
+        self.max_entradas = max_entradas
+        self.max_bytes = max_bytes
+        self.umbral_similitud = umbral_similitud
+        self._entradas = OrderedDict()  # (variante, texto) -> (respuesta, expira, bytes)
+        self._bytes = 0
+        self._huella = None
+        self._indice = IndiceSimilitud() if umbral_similitud else None
+        self._lock = threading.Lock()
+        self.aciertos_exactos = 0
+        self.aciertos_similares = 0
+        self.fallos = 0
+        self.desalojos = 0
+        self.invalidaciones = 0
+
+    def validar(self, *partes):
+        """Vacía la caché si cambió la instrucción de sistema o el modelo."""
+        if partes == self._huella:
+            return
+        with self._lock:
+            if partes != self._huella:
+                if self._huella is not None:
+                    self.invalidaciones += 1
+                    evento("cache_invalidada", huella=_resumen_huella(partes))
+                self._vaciar()
+                self._huella = partes
+
+    def _vaciar(self):
+        self._entradas.clear()
+        self._bytes = 0
+        if self._indice is not None:
+            self._indice.limpiar()
+
+    def _quitar(self, clave):
+        _, _, tamano = self._entradas.pop(clave)
+        self._bytes -= tamano
+        if self._indice is not None:
+            self._indice.quitar(clave)
+
+    def _vigente(self, clave, ahora):
+        entrada = self._entradas.get(clave)
+        if entrada is None:
+            return None
+        if entrada[1] < ahora:
+            self._quitar(clave)
+            return None
+        self._entradas.move_to_end(clave)
+        return entrada[0]
+
+    def obtener(self, variante, mensaje):
+        texto = normalizar(mensaje)
+        clave = (variante, texto)
+        ahora = time.monotonic()
+        with self._lock:
+            respuesta = self._vigente(clave, ahora)
+            if respuesta is not None:
+                self.aciertos_exactos += 1
+                return respuesta
+
+            if self._indice is not None and texto:
+                similar, sim = self._indice.buscar(texto, filtro=lambda c: c[0] == variante)
+                if (similar is not None and sim >= self.umbral_similitud
+                        and negaciones(similar[1]) == negaciones(texto)):
+                    respuesta = self._vigente(similar, ahora)
+                    if respuesta is not None:
+                        self.aciertos_similares += 1
+                        return respuesta
+
+            self.fallos += 1
+            return None
+
+    def guardar(self, variante, mensaje, respuesta):
+        texto = normalizar(mensaje)
+        if not texto:
+            return
+        clave = (variante, texto)
+        tamano = len(respuesta.encode("utf-8")) + len(texto.encode("utf-8"))
+        if tamano > self.max_bytes:
+            return
+        with self._lock:
+            if clave in self._entradas:
+                self._quitar(clave)
+            self._entradas[clave] = (respuesta, time.monotonic() + self.ttl, tamano)
+            self._bytes += tamano
+            if self._indice is not None:
+                self._indice.agregar(clave, texto)
+            while len(self._entradas) > self.max_entradas or self._bytes > self.max_bytes:
+                self._quitar(next(iter(self._entradas)))
+                self.desalojos += 1
+
+    def estadisticas(self):
+        with self._lock:
+            consultas = self.aciertos_exactos + self.aciertos_similares + self.fallos
+            return {
+                "entradas": len(self._entradas),
+                "bytes": self._bytes,
+                "aciertos_exactos": self.aciertos_exactos,
+                "aciertos_similares": self.aciertos_similares,
+                "fallos": self.fallos,
+                "desalojos": self.desalojos,
+                "invalidaciones": self.invalidaciones,
+                "tasa_aciertos": round((self.aciertos_exactos + self.aciertos_similares) / consultas, 4) if consultas else 0.0,
+                "similitud_activa": self._indice is not None,
+            }
+
+
+def _resumen_huella(partes):
+    return hashlib.sha1("\x00".join(map(str, partes)).encode("utf-8")).hexdigest()[:10]
+
+
+cache = CacheRespuestas(umbral_similitud=float(CACHE_UMBRAL_SIMILITUD) if CACHE_UMBRAL_SIMILITUD else None)
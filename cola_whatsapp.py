@@ -0,0 +1,259 @@
+import os
+import time
+import zlib
+import queue
+import threading
+from collections import OrderedDict
+
+from metricas import advertencia, cronometro, error, incrementar
+
+# ==========================================
+# COLA DE WHATSAPP (RESPUESTA INMEDIATA AL WEBHOOK)
+# ==========================================
+# El webhook de Twilio responde 200 vacío al instante y el mensaje se encola.
+# Cada número cae siempre en el mismo hilo (shard), así sus mensajes se
+# responden en orden. La respuesta sale por la API REST de Twilio con
+# reintentos y backoff; si falla el envío no se vuelve a generar la respuesta.
+#
+# Los reintentos de Twilio (mismo MessageSid) pueden caer en otro worker u
+# otro dyno, así que los SID vistos deben vivir en un almacén compartido:
+# WHATSAPP_DEDUP_BACKEND=sqlite:///ruta.db (workers del mismo dyno) o
+# redis://... (entre dynos). Por defecto usa el mismo que LIMITE_BACKEND; sin
+# ninguno queda en memoria del worker, lo que solo sirve con un proceso.
+
+WHATSAPP_MODO_ASINCRONO = os.environ.get("WHATSAPP_MODO_ASINCRONO", "0") == "1"
+WHATSAPP_HILOS = int(os.environ.get("WHATSAPP_HILOS", "8"))
+WHATSAPP_MAX_COLA = int(os.environ.get("WHATSAPP_MAX_COLA", "2000"))
+WHATSAPP_REINTENTOS = int(os.environ.get("WHATSAPP_REINTENTOS", "4"))
+WHATSAPP_BACKOFF_BASE = float(os.environ.get("WHATSAPP_BACKOFF_BASE", "0.5"))
+DEDUP_TTL = float(os.environ.get("WHATSAPP_DEDUP_TTL", "86400"))
+DEDUP_MAX = int(os.environ.get("WHATSAPP_DEDUP_MAX", "100000"))
+WHATSAPP_DEDUP_BACKEND = os.environ.get("WHATSAPP_DEDUP_BACKEND", os.environ.get("LIMITE_BACKEND", ""))
+# Límite de caracteres por mensaje de WhatsApp en Twilio.
+MAX_CARACTERES_MENSAJE = 1600
+
+
+class Deduplicador:
+    """Recuerda MessageSid ya aceptados (TTL + tope de entradas)."""
+
+    def __init__(self, ttl=DEDUP_TTL, maximo=DEDUP_MAX):
+        self.ttl = ttl
+        self.maximo = maximo
+        self._vistos = OrderedDict()
+        self._lock = threading.Lock()
+
+    def marcar(self, sid):
+        """True si el sid es nuevo (y queda marcado); False si es un reintento."""
+        ahora = time.monotonic()
+        with self._lock:
+            while self._vistos:
+                primero, expira = next(iter(self._vistos.items()))
+                if expira > ahora and len(self._vistos) < self.maximo:
+                    break
+                del self._vistos[primero]
+            if sid in self._vistos:
+                return False
+            self._vistos[sid] = ahora + self.ttl
+            return True
+
+    def olvidar(self, sid):
+        with self._lock:
+            self._vistos.pop(sid, None)
+
+
+class DeduplicadorSQLite:
+    """SID vistos en un archivo SQLite compartido por los workers del dyno."""
+
+    PURGAR_CADA = 1000
+
+    def __init__(self, ruta, ttl=DEDUP_TTL):
+        import sqlite3
+        self.ttl = ttl
+        self._conn = sqlite3.connect(ruta, timeout=1.0, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS sids_whatsapp (sid TEXT PRIMARY KEY, expira REAL)")
+        self._lock = threading.Lock()
+        self._altas = 0
+
+    def marcar(self, sid):
+        # time.time() y no monotonic(): el reloj se comparte entre procesos.
+        ahora = time.time()
+        with self._lock:
+            try:
+                self._conn.execute("BEGIN IMMEDIATE")
+                self._conn.execute("DELETE FROM sids_whatsapp WHERE sid = ? AND expira <= ?", (sid, ahora))
+                nuevo = self._conn.execute("INSERT OR IGNORE INTO sids_whatsapp (sid, expira) VALUES (?, ?)",
+                                           (sid, ahora + self.ttl)).rowcount == 1
+                self._altas += nuevo
+                if nuevo and self._altas % self.PURGAR_CADA == 0:
+                    self._conn.execute("DELETE FROM sids_whatsapp WHERE expira <= ?", (ahora,))
+                self._conn.execute("COMMIT")
+                return nuevo
+            except Exception as e:
+                if self._conn.in_transaction:
+                    self._conn.execute("ROLLBACK")
+                # Ante la duda se atiende: un duplicado es mejor que un mensaje perdido.
+                advertencia("dedup_error", backend="sqlite", detalle=str(e))
+                return True
+
+    def olvidar(self, sid):
+        with self._lock:
+            try:
+                self._conn.execute("DELETE FROM sids_whatsapp WHERE sid = ?", (sid,))
+            except Exception as e:
+                advertencia("dedup_error", backend="sqlite", detalle=str(e))
+
+
+class DeduplicadorRedis:
+    """SET NX con expiración: atómico entre dynos."""
+
+    def __init__(self, url, ttl=DEDUP_TTL):
+        import redis
+        self.ttl = max(1, int(ttl))
+        self._cliente = redis.Redis.from_url(url, socket_timeout=0.5)
+
+    def marcar(self, sid):
+        try:
+            return bool(self._cliente.set(f"whatsapp:sid:{sid}", 1, nx=True, ex=self.ttl))
+        except Exception as e:
+            advertencia("dedup_error", backend="redis", detalle=str(e))
+            return True
+
+    def olvidar(self, sid):
+        try:
+            self._cliente.delete(f"whatsapp:sid:{sid}")
+        except Exception as e:
+            advertencia("dedup_error", backend="redis", detalle=str(e))
+
+
+def crear_deduplicador(backend=WHATSAPP_DEDUP_BACKEND):
+    if backend.startswith("sqlite:///"):
+        return DeduplicadorSQLite(backend[len("sqlite:///"):])
+    if backend.startswith(("redis://", "rediss://")):
+        return DeduplicadorRedis(backend)
+    return Deduplicador()
+
+
+def partir_mensaje(texto, maximo=MAX_CARACTERES_MENSAJE):
+    """Divide en trozos <= maximo, cortando preferentemente en saltos de línea."""
+    trozos = []
+    while len(texto) > maximo:
+        corte = texto.rfind("\n", 0, maximo)
+        if corte <= 0:
+            corte = maximo
+        trozos.append(texto[:corte])
+        texto = texto[corte:].lstrip("\n")
+    if texto:
+        trozos.append(texto)
+    return trozos
+
+
+_cliente_twilio = None
+
+
+def enviar_twilio(destino, origen, texto):
+    global _cliente_twilio
+    if _cliente_twilio is None:
+        from twilio.rest import Client
+        _cliente_twilio = Client(os.environ.get("TWILIO_ACCOUNT_SID"), os.environ.get("TWILIO_AUTH_TOKEN"))
+    for trozo in partir_mensaje(texto):
+        _cliente_twilio.messages.create(to=destino, from_=origen, body=trozo)
+
+
+class ColaWhatsApp:
+    """Pool de hilos con una cola acotada por shard y orden por número."""
+
+    _FIN = object()
+
+    def __init__(self, generar, enviador=enviar_twilio, hilos=WHATSAPP_HILOS, max_cola=WHATSAPP_MAX_COLA,
+                 reintentos=WHATSAPP_REINTENTOS, backoff_base=WHATSAPP_BACKOFF_BASE, dedup=None):
+        # generar(celular, mensaje) -> texto de respuesta (también guarda el historial)
+        self.generar = generar
+        # enviador(destino, origen, texto); se reemplaza por un stub en pruebas
+        self.enviador = enviador
+        self.reintentos = reintentos
+        self.backoff_base = backoff_base
+        self.dedup = dedup if dedup is not None else crear_deduplicador()
+        self._colas = [queue.Queue(maxsize=max(1, max_cola // hilos)) for _ in range(hilos)]
+        self._hilos = []
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _asegurar_hilos(self):
+        if self._hilos and self._pid == os.getpid():
+            return
+        with self._lock:
+            if not self._hilos or self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._hilos = [
+                    threading.Thread(target=self._bucle, args=(cola,), name=f"whatsapp-{i}", daemon=True)
+                    for i, cola in enumerate(self._colas)
+                ]
+                for hilo in self._hilos:
+                    hilo.start()
+
+    def encolar(self, sid, celular, mensaje, destino, origen):
+        """'duplicado', 'encolado' o 'lleno' (el llamador atiende en línea)."""
+        if sid and not self.dedup.marcar(sid):
+            return "duplicado"
+        self._asegurar_hilos()
+        cola = self._colas[zlib.crc32(celular.encode("utf-8")) % len(self._colas)]
+        try:
+            cola.put_nowait((sid, celular, mensaje, destino, origen))
+            return "encolado"
+        except queue.Full:
+            if sid:
+                self.dedup.olvidar(sid)
+            return "lleno"
+
+    def pendientes(self):
+        return sum(cola.qsize() for cola in self._colas)
+
+    def _bucle(self, cola):
+        while True:
+            trabajo = cola.get()
+            try:
+                if trabajo is self._FIN:
+                    return
+                self._procesar(*trabajo)
+            finally:
+                cola.task_done()
+
+    def _procesar(self, sid, celular, mensaje, destino, origen):
+        try:
+            texto = self.generar(celular, mensaje)
+        except Exception as e:
+            error("whatsapp_error_generacion", celular=celular, sid=sid, detalle=str(e))
+            return
+        for intento in range(self.reintentos + 1):
+            try:
+                with cronometro("whatsapp_envio"):
+                    self.enviador(destino, origen, texto)
+                incrementar("whatsapp_total", resultado="enviado")
+                return
+            except Exception as e:
+                if intento == self.reintentos:
+                    error("whatsapp_envio_fallido", celular=celular, sid=sid, detalle=str(e))
+                    incrementar("whatsapp_total", resultado="envio_fallido")
+                    return
+                espera = self.backoff_base * (2 ** intento)
+                advertencia("whatsapp_reintento_envio", celular=celular, sid=sid, intento=intento + 1,
+                            espera=round(espera, 2), detalle=str(e))
+                time.sleep(espera)
+
+    def esperar(self):
+        """Bloquea hasta que se procesen todos los trabajos encolados."""
+        for cola in self._colas:
+            cola.join()
+
+    def detener(self, timeout=10.0):
+        if not self._hilos or self._pid != os.getpid():
+            return
+        limite = time.monotonic() + timeout
+        for cola in self._colas:
+            try:
+                cola.put(self._FIN, timeout=max(0.0, limite - time.monotonic()))
+            except queue.Full:
+                pass
+        for hilo in self._hilos:
+            hilo.join(max(0.0, limite - time.monotonic()))
@@ -0,0 +1,52 @@
+# Configuración de gunicorn (se carga automáticamente desde el directorio de trabajo)
+import os
+import shutil
+import tempfile
+
+# Workers gevent: cada proceso atiende muchas conversaciones mientras esperan a Gemini.
+# GUNICORN_WORKER_CLASS=sync vuelve al modo anterior (un worker ocupado por consulta).
+worker_class = os.environ.get("GUNICORN_WORKER_CLASS", "gevent")
+worker_connections = int(os.environ.get("GUNICORN_WORKER_CONNECTIONS", "200"))
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", "120"))
+
+# /metrics suma lo que vuelca cada worker en este directorio (ver metricas.py).
+# Se fija antes del fork para que todos los workers lo hereden.
+os.environ.setdefault("METRICAS_DIR", os.path.join(tempfile.gettempdir(), "cuerpofiel_metricas"))
+
+
+def on_starting(server):
+    # Un master nuevo empieza los contadores de cero: se descartan los volcados
+    # de la ejecución anterior.
+    directorio = os.environ["METRICAS_DIR"]
+    shutil.rmtree(directorio, ignore_errors=True)
+    os.makedirs(directorio, exist_ok=True)
+
+
+def post_worker_init(worker):
+    # Se ejecuta en el worker ya cargada la app y antes de aceptar conexiones.
+    # (post_fork sería antes del monkey-patch de gevent: hilos y sockets creados
+    # ahí no cooperarían con el hub.)
+    if worker_class == "gevent":
+        # psycopg2 es una extensión en C: sin esto bloquearía todo el hub de gevent.
+        from psycogreen.gevent import patch_psycopg
+        patch_psycopg()
+
+    # Importaciones pesadas, cliente de Gemini y pool de DB listos antes del primer
+    # usuario; /healthz pasa a 200 al terminar.
+    import bot_core
+    bot_core.calentar()
+    bot_core.metricas.registro.iniciar_volcado()
+
+
+def worker_exit(server, worker):
+    # Termina los mensajes de WhatsApp encolados, vacía el historial pendiente
+    # y cierra el pool antes de que el worker muera.
+    import sys
+    bot_core = sys.modules.get("bot_core")
+    if bot_core is not None:
+        bot_core.cola_mensajes.detener()
+    import persistencia
+    persistencia.cerrar()
+    # Los contadores de este worker siguen sumando en /metrics después de que muera.
+    import metricas
+    metricas.registro.volcar()
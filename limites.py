@@ -0,0 +1,167 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+
+from metricas import advertencia
+
+# ==========================================
+# LÍMITE POR NÚMERO Y COALESCENCIA DE DUPLICADOS
+# ==========================================
+# Cubeta de tokens por remitente: LIMITE_RAFAGA mensajes seguidos y luego
+# LIMITE_POR_MINUTO sostenidos. Por defecto vive en memoria del worker;
+# LIMITE_BACKEND=sqlite:///ruta.db la comparte entre workers del mismo dyno y
+# LIMITE_BACKEND=redis://... entre dynos (requiere el paquete `redis`).
+#
+# Coalescedor: peticiones simultáneas con la misma clave (celular, mensaje)
+# esperan a la primera y reciben su resultado; solo la primera llama al modelo.
+
+LIMITE_POR_MINUTO = float(os.environ.get("LIMITE_POR_MINUTO", "10"))
+LIMITE_RAFAGA = float(os.environ.get("LIMITE_RAFAGA", "5"))
+LIMITE_BACKEND = os.environ.get("LIMITE_BACKEND", "")
+LIMITE_MAX_CLAVES = int(os.environ.get("LIMITE_MAX_CLAVES", "50000"))
+
+
+class LimitadorMemoria:
+
+    def __init__(self, por_minuto=LIMITE_POR_MINUTO, rafaga=LIMITE_RAFAGA, max_claves=LIMITE_MAX_CLAVES):
+        self.tasa = por_minuto / 60.0
+        self.rafaga = rafaga
+        self.max_claves = max_claves
+        self._cubetas = OrderedDict()  # clave -> (tokens, ultima_vez)
+        self._lock = threading.Lock()
+
+    def permitir(self, clave):
+        ahora = time.monotonic()
+        with self._lock:
+            tokens, ultima = self._cubetas.pop(clave, (self.rafaga, ahora))
+            tokens = min(self.rafaga, tokens + (ahora - ultima) * self.tasa)
+            permitido = tokens >= 1
+            if permitido:
+                tokens -= 1
+            self._cubetas[clave] = (tokens, ahora)
+            while len(self._cubetas) > self.max_claves:
+                self._cubetas.popitem(last=False)
+            return permitido
+
+
+class LimitadorSQLite:
+    """Misma cubeta, en un archivo SQLite compartido por los workers del dyno."""
+
+    def __init__(self, ruta, por_minuto=LIMITE_POR_MINUTO, rafaga=LIMITE_RAFAGA):
+        import sqlite3
+        self.tasa = por_minuto / 60.0
+        self.rafaga = rafaga
+        self._conn = sqlite3.connect(ruta, timeout=1.0, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS cubetas (clave TEXT PRIMARY KEY, tokens REAL, ultima REAL)")
+        self._lock = threading.Lock()
+
+    def permitir(self, clave):
+        # time.time() y no monotonic(): el reloj se comparte entre procesos.
+        ahora = time.time()
+        with self._lock:
+            try:
+                self._conn.execute("BEGIN IMMEDIATE")
+                fila = self._conn.execute("SELECT tokens, ultima FROM cubetas WHERE clave = ?", (clave,)).fetchone()
+                tokens, ultima = fila if fila else (self.rafaga, ahora)
+                tokens = min(self.rafaga, tokens + max(0.0, ahora - ultima) * self.tasa)
+                permitido = tokens >= 1
+                if permitido:
+                    tokens -= 1
+                self._conn.execute("INSERT OR REPLACE INTO cubetas (clave, tokens, ultima) VALUES (?, ?, ?)",
+                                   (clave, tokens, ahora))
+                self._conn.execute("COMMIT")
+                return permitido
+            except Exception as e:
+                if self._conn.in_transaction:
+                    self._conn.execute("ROLLBACK")
+                # Si el backend falla se deja pasar: el límite protege, no debe tumbar el servicio.
+                advertencia("limitador_error", backend="sqlite", detalle=str(e))
+                return True
+
+
+_SCRIPT_REDIS = """
+local t = redis.call('HMGET', KEYS[1], 'tokens', 'ultima')
+local rafaga = tonumber(ARGV[1])
+local tasa = tonumber(ARGV[2])
+local ahora = tonumber(ARGV[3])
+local tokens = tonumber(t[1]) or rafaga
+local ultima = tonumber(t[2]) or ahora
+tokens = math.min(rafaga, tokens + math.max(0, ahora - ultima) * tasa)
+local permitido = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    permitido = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ultima', ahora)
+redis.call('EXPIRE', KEYS[1], math.ceil(rafaga / tasa) + 60)
+return permitido
+"""
+
+
+class LimitadorRedis:
+    """Cubeta atómica con un script Lua; sirve con Redis o cualquier servidor compatible."""
+
+    def __init__(self, url, por_minuto=LIMITE_POR_MINUTO, rafaga=LIMITE_RAFAGA):
+        import redis
+        self.tasa = por_minuto / 60.0
+        self.rafaga = rafaga
+        self._cliente = redis.Redis.from_url(url, socket_timeout=0.5)
+        self._script = self._cliente.register_script(_SCRIPT_REDIS)
+
+    def permitir(self, clave):
+        try:
+            return bool(self._script(keys=[f"limite:{clave}"], args=[self.rafaga, self.tasa, time.time()]))
+        except Exception as e:
+            advertencia("limitador_error", backend="redis", detalle=str(e))
+            return True
+
+
+def crear_limitador(backend=LIMITE_BACKEND):
+    if backend.startswith("sqlite:///"):
+        return LimitadorSQLite(backend[len("sqlite:///"):])
+    if backend.startswith(("redis://", "rediss://")):
+        return LimitadorRedis(backend)
+    return LimitadorMemoria()
+
+
+class _Llamada:
+
+    def __init__(self):
+        self.listo = threading.Event()
+        self.resultado = None
+        self.error = None
+
+
+class Coalescedor:
+    """Single-flight: una sola ejecución por clave mientras esté en curso."""
+
+    def __init__(self):
+        self._en_curso = {}
+        self._lock = threading.Lock()
+
+    def ejecutar(self, clave, funcion):
+        """Devuelve (resultado, es_lider)."""
+        with self._lock:
+            llamada = self._en_curso.get(clave)
+            lider = llamada is None
+            if lider:
+                llamada = self._en_curso[clave] = _Llamada()
+
+        if not lider:
+            llamada.listo.wait()
+            if llamada.error is not None:
+                raise llamada.error
+            return llamada.resultado, False
+
+        try:
+            llamada.resultado = funcion()
+        except Exception as e:
+            llamada.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._en_curso[clave]
+            llamada.listo.set()
+        return llamada.resultado, True
@@ -0,0 +1,270 @@
+import os
+import math
+import time
+import threading
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import persistencia
+from metricas import cronometro, error, evento
+
+# ==========================================
+# MEMORIA DE CONVERSACIÓN POR USUARIO
+# ==========================================
+# LRU en proceso con los turnos recientes de cada celular; si no está en
+# memoria se carga de la DB (resumen + turnos posteriores al resumen). El
+# prompt nunca supera MEMORIA_PRESUPUESTO_TOKENS: los turnos que no caben se
+# condensan en segundo plano en un resumen acumulado que se guarda en
+# resumen_conversaciones, así el tamaño del prompt se mantiene constante.
+#
+# Con varios workers o dynos los mensajes de un número se reparten entre
+# procesos, así que la DB es la fuente de verdad:
+#   * Una sesión se recarga de la DB cuando tiene más de MEMORIA_TTL segundos;
+#     los turnos propios que el escritor en lotes aún no insertó se conservan.
+#   * La marca de agua del resumen es el created_at de la DB del último turno
+#     resumido (nunca el reloj de la app), y los turnos a resumir se leen de la
+#     DB en ese rango, incluidos los que atendió otro proceso.
+#   * El resumen se guarda con compare-and-set sobre la marca anterior: si otro
+#     proceso resumió primero, el nuestro se descarta y la sesión se recarga.
+
+MEMORIA_MAX_SESIONES = int(os.environ.get("MEMORIA_MAX_SESIONES", "5000"))
+MEMORIA_PRESUPUESTO_TOKENS = int(os.environ.get("MEMORIA_PRESUPUESTO_TOKENS", "1500"))
+MEMORIA_TURNOS_CARGA = int(os.environ.get("MEMORIA_TURNOS_CARGA", "20"))
+MEMORIA_TTL = float(os.environ.get("MEMORIA_TTL", "30"))
+# Máximo de caracteres del resumen acumulado (~1/3 del presupuesto).
+MAX_CARACTERES_RESUMEN = MEMORIA_PRESUPUESTO_TOKENS * 4 // 3
+
+SQL_CARGAR_RESUMEN = "SELECT resumen, resumido_hasta FROM resumen_conversaciones WHERE celular = %s"
+SQL_CARGAR_TURNOS = (
+    "SELECT mensaje_recibido, respuesta_dada, created_at FROM historial_consultas "
+    "WHERE celular = %s AND created_at > %s ORDER BY created_at DESC LIMIT %s"
+)
+# Siempre devuelve al menos una fila (la de la marca del resumen, con turno NULL si no hay nuevos).
+SQL_TURNOS_NUEVOS = (
+    "SELECT r.resumido_hasta, h.mensaje_recibido, h.respuesta_dada, h.created_at "
+    "FROM (SELECT %s::text AS celular) c "
+    "LEFT JOIN resumen_conversaciones r ON r.celular = c.celular "
+    "LEFT JOIN historial_consultas h ON h.celular = c.celular AND h.created_at > %s "
+    "ORDER BY h.created_at LIMIT %s"
+)
+SQL_TURNOS_A_RESUMIR = (
+    "SELECT mensaje_recibido, respuesta_dada FROM historial_consultas "
+    "WHERE celular = %s AND created_at > %s AND created_at <= %s ORDER BY created_at"
+)
+SQL_GUARDAR_RESUMEN = (
+    "INSERT INTO resumen_conversaciones (celular, resumen, resumido_hasta) VALUES (%s, %s, %s) "
+    "ON CONFLICT (celular) DO UPDATE SET resumen = EXCLUDED.resumen, resumido_hasta = EXCLUDED.resumido_hasta "
+    "WHERE resumen_conversaciones.resumido_hasta = %s"
+)
+
+_EPOCA = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def estimar_tokens(texto):
+    # Aproximación de ~4 caracteres por token; suficiente para acotar el prompt.
+    return math.ceil(len(texto) / 4) if texto else 0
+
+
+class Sesion:
+
+    def __init__(self, resumen="", resumido_hasta=_EPOCA, turnos=()):
+        self.resumen = resumen
+        self.resumido_hasta = resumido_hasta
+        # (mensaje, respuesta, created_at), del más viejo al más nuevo; created_at es
+        # None en los turnos de este proceso que todavía no se leyeron de la DB.
+        self.turnos = deque(turnos)
+        # created_at más reciente que esta sesión ya leyó de la DB.
+        self.sincronizada = max((f for _, _, f in self.turnos if f is not None), default=resumido_hasta)
+        self.resumiendo = False
+        self.cargada = time.monotonic()
+        self.lock = threading.Lock()
+
+    def tokens(self):
+        return estimar_tokens(self.resumen) + sum(estimar_tokens(m) + estimar_tokens(r) for m, r, _ in self.turnos)
+
+
+class MemoriaSesiones:
+
+    def __init__(self, max_sesiones=MEMORIA_MAX_SESIONES, presupuesto=MEMORIA_PRESUPUESTO_TOKENS,
+                 turnos_carga=MEMORIA_TURNOS_CARGA, ttl=MEMORIA_TTL, resumidor=None):
+        self.max_sesiones = max_sesiones
+        self.presupuesto = presupuesto
+        self.turnos_carga = turnos_carga
+        self.ttl = ttl
+        # resumidor(resumen_previo, [(mensaje, respuesta), ...]) -> nuevo resumen
+        self.resumidor = resumidor
+        self._sesiones = OrderedDict()
+        self._lock = threading.Lock()
+        self._ejecutor = None
+
+    def _cargar(self, celular):
+        try:
+            with persistencia.conexion() as conn:
+                with conn.cursor() as cursor:
+                    cursor.execute(SQL_CARGAR_RESUMEN, (celular,))
+                    fila = cursor.fetchone()
+                    resumen, resumido_hasta = fila if fila else ("", _EPOCA)
+                    cursor.execute(SQL_CARGAR_TURNOS, (celular, resumido_hasta, self.turnos_carga))
+                    turnos = reversed(cursor.fetchall())
+            return Sesion(resumen, resumido_hasta, turnos)
+        except Exception as e:
+            error("memoria_error_carga", celular=celular, detalle=str(e))
+            return None
+
+    def obtener(self, celular):
+        with self._lock:
+            vieja = self._sesiones.get(celular)
+            if vieja is not None:
+                self._sesiones.move_to_end(celular)
+                if time.monotonic() - vieja.cargada < self.ttl:
+                    return vieja
+
+        # La DB va fuera del candado global para no frenar a otros usuarios.
+        if vieja is not None:
+            with cronometro("memoria_sincronizacion_db"):
+                al_dia = self._sincronizar(celular, vieja)
+            if al_dia:
+                vieja.cargada = time.monotonic()
+                return vieja
+        with cronometro("memoria_carga_db"):
+            sesion = self._cargar(celular)
+        if sesion is None:
+            if vieja is None:
+                return self._guardar(celular, None, Sesion())
+            # Con la DB caída se sigue con lo que hay en memoria hasta el próximo TTL.
+            vieja.cargada = time.monotonic()
+            return vieja
+        if vieja is not None:
+            self._conservar_pendientes(vieja, sesion)
+        return self._guardar(celular, vieja, sesion)
+
+    def _sincronizar(self, celular, vieja):
+        """Agrega a `vieja` las filas nuevas de la DB; False si hace falta la carga completa."""
+        try:
+            with persistencia.conexion() as conn:
+                with conn.cursor() as cursor:
+                    cursor.execute(SQL_TURNOS_NUEVOS, (celular, vieja.sincronizada, self.turnos_carga + 1))
+                    filas = cursor.fetchall()
+        except Exception as e:
+            # Con la DB caída se sigue con lo que hay en memoria hasta el próximo TTL.
+            error("memoria_error_carga", celular=celular, detalle=str(e))
+            return True
+        resumido_hasta = filas[0][0] or _EPOCA
+        nuevos = [(m, r, f) for _, m, r, f in filas if f is not None]
+        with vieja.lock:
+            if resumido_hasta != vieja.resumido_hasta or len(nuevos) > self.turnos_carga:
+                return False
+            if nuevos:
+                # Los turnos propios que ya llegaron a la DB toman su created_at; el resto es de otro proceso.
+                pendientes = [(m, r) for m, r, f in vieja.turnos if f is None]
+                for m, r, _ in nuevos:
+                    if (m, r) in pendientes:
+                        pendientes.remove((m, r))
+                fechados = [t for t in vieja.turnos if t[2] is not None] + nuevos
+                vieja.turnos = deque(fechados[-self.turnos_carga:] + [(m, r, None) for m, r in pendientes])
+                vieja.sincronizada = nuevos[-1][2]
+        return True
+
+    def _guardar(self, celular, vieja, sesion):
+        with self._lock:
+            actual = self._sesiones.get(celular)
+            if actual is None or actual is vieja:
+                self._sesiones[celular] = actual = sesion
+            self._sesiones.move_to_end(celular)
+            while len(self._sesiones) > self.max_sesiones:
+                self._sesiones.popitem(last=False)
+        return actual
+
+    @staticmethod
+    def _conservar_pendientes(vieja, nueva):
+        """Pasa a `nueva` los turnos de `vieja` que el escritor aún no insertó."""
+        with vieja.lock:
+            sincronizada = vieja.sincronizada
+            pendientes = [(m, r) for m, r, f in vieja.turnos if f is None]
+        # Los que ya aparecen en la DB (posteriores a lo que vieja había leído) están en `nueva`.
+        en_db = Counter((m, r) for m, r, f in nueva.turnos if f > sincronizada)
+        for turno in pendientes:
+            if en_db[turno]:
+                en_db[turno] -= 1
+            else:
+                nueva.turnos.append(turno + (None,))
+
+    def historial_para_prompt(self, celular):
+        """Historial en formato de Gemini, acotado al presupuesto de tokens."""
+        sesion = self.obtener(celular)
+        with sesion.lock:
+            historial = []
+            disponibles = self.presupuesto - estimar_tokens(sesion.resumen)
+            recientes = []
+            for mensaje, respuesta, _ in reversed(sesion.turnos):
+                costo = estimar_tokens(mensaje) + estimar_tokens(respuesta)
+                if costo > disponibles:
+                    break
+                disponibles -= costo
+                recientes.append((mensaje, respuesta))
+
+            if sesion.resumen:
+                historial.append({"role": "user", "parts": [f"Resumen de nuestra conversación anterior: {sesion.resumen}"]})
+                historial.append({"role": "model", "parts": ["Entendido, lo tendré en cuenta."]})
+            for mensaje, respuesta in reversed(recientes):
+                historial.append({"role": "user", "parts": [mensaje]})
+                historial.append({"role": "model", "parts": [respuesta]})
+            return historial
+
+    def registrar(self, celular, mensaje, respuesta):
+        sesion = self.obtener(celular)
+        with sesion.lock:
+            sesion.turnos.append((mensaje, respuesta, None))
+            if sesion.tokens() <= self.presupuesto or sesion.resumiendo or self.resumidor is None:
+                return
+            # Se condensan los turnos más viejos hasta quedar en la mitad del presupuesto;
+            # solo los que ya tienen created_at de la DB, que es la marca de agua.
+            viejos = []
+            while sesion.turnos and sesion.turnos[0][2] is not None:
+                # Las filas de un mismo lote comparten created_at: se resumen juntas.
+                mismo_lote = viejos and sesion.turnos[0][2] == viejos[-1][2]
+                if sesion.tokens() <= self.presupuesto // 2 and not mismo_lote:
+                    break
+                viejos.append(sesion.turnos.popleft())
+            if not viejos:
+                return
+            sesion.resumiendo = True
+            trabajo = (celular, sesion, sesion.resumen, sesion.resumido_hasta, viejos[-1][2])
+        self._enviar(*trabajo)
+
+    def _enviar(self, *trabajo):
+        if self._ejecutor is None:
+            with self._lock:
+                if self._ejecutor is None:
+                    self._ejecutor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="resumen-memoria")
+        self._ejecutor.submit(self._resumir, *trabajo)
+
+    def _resumir(self, celular, sesion, resumen_previo, desde, hasta):
+        try:
+            with persistencia.conexion() as conn:
+                with conn.cursor() as cursor:
+                    cursor.execute(SQL_TURNOS_A_RESUMIR, (celular, desde, hasta))
+                    turnos = cursor.fetchall()
+            nuevo = self.resumidor(resumen_previo, turnos)
+            nuevo = (nuevo or "").strip()[:MAX_CARACTERES_RESUMEN]
+            with persistencia.conexion() as conn:
+                with conn.cursor() as cursor:
+                    cursor.execute(SQL_GUARDAR_RESUMEN, (celular, nuevo, hasta, desde))
+                    guardado = cursor.rowcount == 1
+            if guardado:
+                with sesion.lock:
+                    sesion.resumen = nuevo
+                    sesion.resumido_hasta = hasta
+            else:
+                # Otro proceso movió la marca primero: la próxima consulta recarga su resumen.
+                evento("memoria_resumen_descartado", celular=celular)
+                sesion.cargada = float("-inf")
+        except Exception as e:
+            # Si falla, esos turnos se pierden del contexto pero el prompt sigue acotado.
+            error("memoria_error_resumen", celular=celular, detalle=str(e))
+        finally:
+            sesion.resumiendo = False
+
+
+memoria = MemoriaSesiones()
@@ -0,0 +1,359 @@
+import os
+import sys
+import json
+import time
+import logging
+import threading
+from bisect import bisect_left
+from collections import deque
+from contextlib import contextmanager
+
+# ==========================================
+# MÉTRICAS Y REGISTRO ESTRUCTURADO
+# ==========================================
+# Contadores, histogramas por etapa (con p50/p95/p99 sobre una ventana de
+# muestras recientes) y medidores calculados al vuelo; /metrics los expone en
+# formato de texto de Prometheus.
+#
+# Con METRICAS_DIR (gunicorn.conf.py lo fija) cada worker vuelca sus valores a
+# <METRICAS_DIR>/<pid>.json cada METRICAS_INTERVALO segundos, al salir y al
+# responder /metrics; el worker que atiende /metrics suma los archivos de todos.
+# Los contadores de workers ya muertos se siguen sumando, así el total no
+# retrocede cuando gunicorn recicla uno; los medidores son del instante y se
+# exponen por worker vivo (etiqueta worker). El directorio se vacía al arrancar
+# el master, que es cuando los contadores vuelven a cero. Sin METRICAS_DIR los
+# valores son solo del proceso que responde.
+#
+# Cada dyno de Heroku es otra máquina con su propio directorio: sus métricas
+# no se suman entre sí. Con DYNO (o METRICAS_INSTANCIA) definido todas las
+# series llevan la etiqueta instancia para distinguirlas al agregarlas.
+#
+# evento() reemplaza a los print(): una línea JSON por evento en stdout.
+
+PREFIJO = "cuerpofiel_"
+# Límites de los buckets (segundos): desde el triage (µs) hasta Gemini (s).
+BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+CUANTILES = (0.5, 0.95, 0.99)
+VENTANA_MUESTRAS = 2048
+# Muestras recientes por histograma que cada worker vuelca para los cuantiles.
+MUESTRAS_VOLCADAS = 256
+
+METRICAS_DIR = os.environ.get("METRICAS_DIR", "")
+METRICAS_INTERVALO = float(os.environ.get("METRICAS_INTERVALO", "5"))
+METRICAS_INSTANCIA = os.environ.get("METRICAS_INSTANCIA") or os.environ.get("DYNO", "")
+
+DESCRIPCIONES = {
+    "etapa_segundos": "Duración de cada etapa del procesamiento de un mensaje.",
+    "peticion_segundos": "Duración total de la petición HTTP por ruta.",
+    "mensajes_total": "Mensajes recibidos por canal.",
+    "emergencias_total": "Mensajes derivados a urgencias por el triage.",
+    "cache_consultas_total": "Consultas a la caché de respuestas por resultado.",
+    "errores_modelo_total": "Llamadas a Gemini que terminaron en error.",
+    "saturacion_total": "Consultas rechazadas por la cola de Gemini llena.",
+    "limite_excedido_total": "Mensajes rechazados por el límite por número.",
+    "coalescidas_total": "Peticiones duplicadas que compartieron una llamada en curso.",
+    "whatsapp_total": "Webhooks de WhatsApp en modo asíncrono por resultado.",
+    "historial_filas_total": "Filas de historial escritas en la DB por resultado.",
+}
+
+
+def _escapar(valor):
+    return str(valor).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _formatear_etiquetas(etiquetas, extra=()):
+    pares = list(etiquetas) + list(extra)
+    if not pares:
+        return ""
+    return "{" + ",".join(f'{k}="{_escapar(v)}"' for k, v in pares) + "}"
+
+
+def _formatear_numero(valor):
+    if valor == float("inf"):
+        return "+Inf"
+    return repr(float(valor)) if isinstance(valor, float) else str(valor)
+
+
+class Histograma:
+
+    def __init__(self):
+        self.conteos = [0] * (len(BUCKETS) + 1)
+        self.suma = 0.0
+        self.cantidad = 0
+        self.muestras = deque(maxlen=VENTANA_MUESTRAS)
+
+    def observar(self, valor):
+        self.conteos[bisect_left(BUCKETS, valor)] += 1
+        self.suma += valor
+        self.cantidad += 1
+        self.muestras.append(valor)
+
+    def cuantiles(self):
+        return _cuantiles(self.muestras)
+
+
+def _cuantiles(muestras):
+    ordenadas = sorted(muestras)
+    if not ordenadas:
+        return {q: 0.0 for q in CUANTILES}
+    return {q: ordenadas[min(len(ordenadas) - 1, int(q * len(ordenadas)))] for q in CUANTILES}
+
+
+def _vivo(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _etiquetas(pares):
+    return tuple((k, v) for k, v in pares)
+
+
+class Registro:
+
+    def __init__(self, directorio=METRICAS_DIR, intervalo=METRICAS_INTERVALO, instancia=METRICAS_INSTANCIA):
+        self.directorio = directorio
+        self.intervalo = intervalo
+        self.instancia = instancia
+        self._contadores = {}   # (nombre, etiquetas) -> valor
+        self._histogramas = {}  # (nombre, etiquetas) -> Histograma
+        self._medidores = {}    # nombre -> función sin argumentos
+        self._lock = threading.Lock()
+        self._version = 0
+        self._volcada = None
+        self._hilo = None
+
+    def incrementar(self, nombre, valor=1, **etiquetas):
+        clave = (nombre, tuple(sorted(etiquetas.items())))
+        with self._lock:
+            self._contadores[clave] = self._contadores.get(clave, 0) + valor
+            self._version += 1
+
+    def observar(self, nombre, valor, **etiquetas):
+        clave = (nombre, tuple(sorted(etiquetas.items())))
+        with self._lock:
+            histograma = self._histogramas.get(clave)
+            if histograma is None:
+                histograma = self._histogramas[clave] = Histograma()
+            histograma.observar(valor)
+            self._version += 1
+
+    def medidor(self, nombre, funcion, descripcion=""):
+        if descripcion:
+            DESCRIPCIONES[nombre] = descripcion
+        self._medidores[nombre] = funcion
+
+    @contextmanager
+    def cronometro(self, etapa):
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observar("etapa_segundos", time.perf_counter() - inicio, etapa=etapa)
+
+    def resumen(self):
+        """Cuantiles por histograma y contadores, para el benchmark y depuración."""
+        with self._lock:
+            histogramas = {
+                (nombre, etiquetas): (h.cantidad, h.suma, h.cuantiles())
+                for (nombre, etiquetas), h in self._histogramas.items()
+            }
+            contadores = dict(self._contadores)
+        return histogramas, contadores
+
+    def reiniciar(self):
+        with self._lock:
+            self._contadores.clear()
+            self._histogramas.clear()
+            self._version += 1
+
+    # --- VOLCADO ENTRE WORKERS ---
+    def _ruta(self, pid):
+        return os.path.join(self.directorio, f"{pid}.json")
+
+    def volcar(self):
+        """Escribe los valores de este proceso en <directorio>/<pid>.json (reemplazo atómico)."""
+        if not self.directorio:
+            return
+        with self._lock:
+            version = self._version
+            datos = {
+                "pid": os.getpid(),
+                "contadores": [[n, e, v] for (n, e), v in self._contadores.items()],
+                "histogramas": [
+                    [n, e, h.conteos, h.suma, h.cantidad, list(h.muestras)[-MUESTRAS_VOLCADAS:]]
+                    for (n, e), h in self._histogramas.items()
+                ],
+            }
+        datos["medidores"] = self._leer_medidores()
+        ruta = self._ruta(datos["pid"])
+        try:
+            os.makedirs(self.directorio, exist_ok=True)
+            with open(ruta + ".tmp", "w", encoding="utf-8") as f:
+                json.dump(datos, f)
+            os.replace(ruta + ".tmp", ruta)
+        except OSError as e:
+            advertencia("metricas_volcado_error", detalle=str(e))
+            return
+        self._volcada = version
+
+    def iniciar_volcado(self):
+        """Hilo que vuelca cada `intervalo` segundos si algo cambió (una vez por worker)."""
+        if not self.directorio or (self._hilo is not None and self._hilo.is_alive()):
+            return
+
+        def bucle():
+            while True:
+                time.sleep(self.intervalo)
+                if self._version != self._volcada:
+                    self.volcar()
+
+        self._hilo = threading.Thread(target=bucle, name="metricas-volcado", daemon=True)
+        self._hilo.start()
+
+    def _leer_medidores(self):
+        valores = {}
+        for nombre, funcion in list(self._medidores.items()):
+            try:
+                valores[nombre] = funcion()
+            except Exception:
+                continue
+        return valores
+
+    def _locales(self):
+        with self._lock:
+            contadores = dict(self._contadores)
+            histogramas = {
+                clave: (list(h.conteos), h.suma, h.cantidad, h.cuantiles())
+                for clave, h in self._histogramas.items()
+            }
+        medidores = {(nombre, ()): valor for nombre, valor in self._leer_medidores().items()}
+        return contadores, histogramas, medidores
+
+    def _combinados(self):
+        """Suma los volcados de todos los workers del directorio (incluido este)."""
+        self.volcar()
+        contadores, acumulados, medidores = {}, {}, {}
+        try:
+            archivos = [a for a in os.listdir(self.directorio) if a.endswith(".json")]
+        except OSError:
+            archivos = []
+        for archivo in archivos:
+            try:
+                with open(os.path.join(self.directorio, archivo), encoding="utf-8") as f:
+                    datos = json.load(f)
+            except (OSError, ValueError):
+                continue
+            for nombre, etiquetas, valor in datos["contadores"]:
+                clave = (nombre, _etiquetas(etiquetas))
+                contadores[clave] = contadores.get(clave, 0) + valor
+            for nombre, etiquetas, conteos, suma, cantidad, muestras in datos["histogramas"]:
+                clave = (nombre, _etiquetas(etiquetas))
+                actual = acumulados.get(clave)
+                if actual is None:
+                    actual = acumulados[clave] = [[0] * len(conteos), 0.0, 0, []]
+                actual[0] = [a + b for a, b in zip(actual[0], conteos)]
+                actual[1] += suma
+                actual[2] += cantidad
+                actual[3].extend(muestras)
+            if _vivo(datos["pid"]):
+                for nombre, valor in datos["medidores"].items():
+                    medidores[(nombre, (("worker", str(datos["pid"])),))] = valor
+        histogramas = {
+            clave: (conteos, suma, cantidad, _cuantiles(muestras))
+            for clave, (conteos, suma, cantidad, muestras) in acumulados.items()
+        }
+        return contadores, histogramas, medidores
+
+    def exponer(self):
+        """Texto en formato de exposición de Prometheus 0.0.4."""
+        contadores, histogramas, medidores = self._combinados() if self.directorio else self._locales()
+        base = (("instancia", self.instancia),) if self.instancia else ()
+        contadores = [((nombre, base + etiquetas), valor) for (nombre, etiquetas), valor in sorted(contadores.items())]
+        histogramas = [
+            ((nombre, base + etiquetas), conteos, suma, cantidad, cuantiles)
+            for (nombre, etiquetas), (conteos, suma, cantidad, cuantiles) in sorted(histogramas.items())
+        ]
+        lineas = []
+        vistos = set()
+
+        def cabecera(nombre, tipo):
+            if nombre not in vistos:
+                vistos.add(nombre)
+                if nombre in DESCRIPCIONES:
+                    lineas.append(f"# HELP {PREFIJO}{nombre} {DESCRIPCIONES[nombre]}")
+                lineas.append(f"# TYPE {PREFIJO}{nombre} {tipo}")
+
+        for (nombre, etiquetas), valor in contadores:
+            cabecera(nombre, "counter")
+            lineas.append(f"{PREFIJO}{nombre}{_formatear_etiquetas(etiquetas)} {_formatear_numero(valor)}")
+
+        for (nombre, etiquetas), conteos, suma, cantidad, cuantiles in histogramas:
+            cabecera(nombre, "histogram")
+            acumulado = 0
+            for limite, conteo in zip(BUCKETS + (float("inf"),), conteos):
+                acumulado += conteo
+                le = _formatear_etiquetas(etiquetas, [("le", _formatear_numero(limite))])
+                lineas.append(f"{PREFIJO}{nombre}_bucket{le} {acumulado}")
+            lineas.append(f"{PREFIJO}{nombre}_sum{_formatear_etiquetas(etiquetas)} {_formatear_numero(suma)}")
+            lineas.append(f"{PREFIJO}{nombre}_count{_formatear_etiquetas(etiquetas)} {cantidad}")
+
+        for (nombre, etiquetas), _, _, _, cuantiles in histogramas:
+            cabecera(f"{nombre}_cuantil", "gauge")
+            for q, valor in cuantiles.items():
+                q_etiquetas = _formatear_etiquetas(etiquetas, [("quantile", q)])
+                lineas.append(f"{PREFIJO}{nombre}_cuantil{q_etiquetas} {_formatear_numero(valor)}")
+
+        for (nombre, etiquetas), valor in sorted(medidores.items()):
+            cabecera(nombre, "gauge")
+            lineas.append(f"{PREFIJO}{nombre}{_formatear_etiquetas(base + etiquetas)} {_formatear_numero(valor)}")
+
+        return "\n".join(lineas) + "\n"
+
+
+registro = Registro()
+incrementar = registro.incrementar
+observar = registro.observar
+cronometro = registro.cronometro
+
+
+# --- REGISTRO ESTRUCTURADO (JSON POR LÍNEA) ---
+class FormatoJSON(logging.Formatter):
+
+    def format(self, record):
+        datos = {
+            "ts": round(record.created, 3),
+            "nivel": record.levelname.lower(),
+            "evento": record.getMessage(),
+            "modulo": record.module,
+        }
+        datos.update(getattr(record, "campos", {}))
+        if record.exc_info:
+            datos["excepcion"] = self.formatException(record.exc_info)
+        return json.dumps(datos, ensure_ascii=False, default=str)
+
+
+_logger = logging.getLogger("cuerpofiel")
+if not _logger.handlers:
+    _manejador = logging.StreamHandler(sys.stdout)
+    _manejador.setFormatter(FormatoJSON())
+    _logger.addHandler(_manejador)
+    _logger.setLevel(logging.INFO)
+    _logger.propagate = False
+
+
+def evento(nombre, nivel=logging.INFO, **campos):
+    # stacklevel=2: "modulo" es quien llamó a evento(), no este archivo.
+    _logger.log(nivel, nombre, extra={"campos": campos}, stacklevel=2)
+
+
+def advertencia(nombre, **campos):
+    _logger.log(logging.WARNING, nombre, extra={"campos": campos}, stacklevel=2)
+
+
+def error(nombre, **campos):
+    _logger.log(logging.ERROR, nombre, extra={"campos": campos}, stacklevel=2)
@@ -0,0 +1,88 @@
+"""Migraciones del esquema: se ejecutan una vez por despliegue, no en cada worker.
+
+En Heroku corren en la fase release (ver Procfile); a mano:
+
+    python migrar.py
+
+Cada paso comprueba primero si ya está aplicado, así que repetirlo es barato
+y no toma candados: el ALTER TABLE (ACCESS EXCLUSIVE) solo se ejecuta si falta
+la columna, y con lock_timeout para no quedar encolado detrás de otras
+transacciones bloqueando a todos los INSERT. Sale con código 1 si algo falla,
+lo que detiene el despliegue.
+"""
+import sys
+
+import persistencia
+from metricas import error, evento
+
+LOCK_TIMEOUT = "5s"
+
+SQL_EXISTE_CREATED_AT = (
+    "SELECT 1 FROM information_schema.columns "
+    "WHERE table_name = 'historial_consultas' AND column_name = 'created_at'"
+)
+SQL_AGREGAR_CREATED_AT = (
+    "ALTER TABLE historial_consultas ADD COLUMN IF NOT EXISTS created_at TIMESTAMPTZ NOT NULL DEFAULT now()"
+)
+SQL_CREAR_RESUMENES = (
+    "CREATE TABLE IF NOT EXISTS resumen_conversaciones ("
+    " celular TEXT PRIMARY KEY,"
+    " resumen TEXT NOT NULL,"
+    " resumido_hasta TIMESTAMPTZ NOT NULL)"
+)
+SQL_ESTADO_INDICE = (
+    "SELECT i.indisvalid FROM pg_class c JOIN pg_index i ON i.indexrelid = c.oid "
+    "WHERE c.relname = 'idx_historial_celular_fecha'"
+)
+# Un CREATE INDEX CONCURRENTLY interrumpido deja el índice inválido; se borra y se rehace.
+SQL_BORRAR_INDICE = "DROP INDEX CONCURRENTLY IF EXISTS idx_historial_celular_fecha"
+# CONCURRENTLY para no bloquear los INSERT mientras se construye el índice.
+SQL_CREAR_INDICE = (
+    "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_historial_celular_fecha "
+    "ON historial_consultas (celular, created_at DESC)"
+)
+
+
+def migrar(cursor):
+    """Aplica los pasos pendientes; devuelve los nombres de los que ejecutó."""
+    aplicados = []
+    cursor.execute(f"SET lock_timeout = '{LOCK_TIMEOUT}'")
+
+    cursor.execute(SQL_EXISTE_CREATED_AT)
+    if cursor.fetchone() is None:
+        cursor.execute(SQL_AGREGAR_CREATED_AT)
+        aplicados.append("historial_created_at")
+
+    cursor.execute(SQL_CREAR_RESUMENES)
+
+    cursor.execute(SQL_ESTADO_INDICE)
+    fila = cursor.fetchone()
+    if fila is None or not fila[0]:
+        if fila is not None:
+            cursor.execute(SQL_BORRAR_INDICE)
+        cursor.execute(SQL_CREAR_INDICE)
+        aplicados.append("idx_historial_celular_fecha")
+    return aplicados
+
+
+def main():
+    try:
+        with persistencia.conexion() as conn:
+            # CREATE INDEX CONCURRENTLY no puede correr dentro de una transacción.
+            conn.autocommit = True
+            try:
+                with conn.cursor() as cursor:
+                    aplicados = migrar(cursor)
+            finally:
+                conn.autocommit = False
+    except Exception as e:
+        error("migracion_error", detalle=str(e))
+        return 1
+    finally:
+        persistencia.cerrar_pool()
+    evento("migracion_lista", aplicados=aplicados)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
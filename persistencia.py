@@ -0,0 +1,185 @@
+import os
+import time
+import queue
+import atexit
+import threading
+from contextlib import contextmanager
+
+from metricas import advertencia, cronometro, error, incrementar
+
+# ==========================================
+# PERSISTENCIA DEL HISTORIAL (POOL + ESCRITOR EN SEGUNDO PLANO)
+# ==========================================
+# La ruta /chat solo encola; un hilo por worker agrupa los INSERT en lotes
+# y los escribe usando conexiones reutilizadas de un pool acotado.
+# psycopg2 se importa al crear el pool, no al importar el módulo.
+
+POOL_MIN = int(os.environ.get("DB_POOL_MIN", "1"))
+POOL_MAX = int(os.environ.get("DB_POOL_MAX", "4"))
+TAMANO_LOTE = int(os.environ.get("HISTORIAL_TAMANO_LOTE", "100"))
+INTERVALO_FLUSH = float(os.environ.get("HISTORIAL_INTERVALO_FLUSH", "1.0"))
+MAX_COLA = int(os.environ.get("HISTORIAL_MAX_COLA", "10000"))
+
+SQL_INSERT_HISTORIAL = "INSERT INTO historial_consultas (celular, mensaje_recibido, respuesta_dada) VALUES %s"
+
+_pool = None
+_pool_pid = None
+_pool_cupos = threading.BoundedSemaphore(POOL_MAX)
+_pool_lock = threading.Lock()
+
+
+def parametros_conexion():
+    database_url = os.environ.get('DATABASE_URL')
+    if database_url:
+        # Heroku exige SSL; DB_SSLMODE=disable sirve para un Postgres local.
+        return {"dsn": database_url, "sslmode": os.environ.get("DB_SSLMODE", "require")}
+    return {"user": "root", "password": "root", "host": "localhost", "port": "5432", "database": "cuerpo_fiel_db"}
+
+
+def obtener_pool():
+    """Devuelve el pool del proceso actual (se crea de nuevo tras un fork)."""
+    global _pool, _pool_pid
+    if _pool is not None and _pool_pid == os.getpid():
+        return _pool
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            try:
+                from psycopg2 import pool as pg_pool
+                _pool = pg_pool.ThreadedConnectionPool(POOL_MIN, POOL_MAX, **parametros_conexion())
+                _pool_pid = os.getpid()
+            except Exception as e:
+                error("db_error_pool", detalle=str(e))
+                _pool = None
+    return _pool
+
+
+@contextmanager
+def conexion():
+    """Presta una conexión del pool; hace commit/rollback y siempre la devuelve."""
+    pool = obtener_pool()
+    if pool is None:
+        import psycopg2
+        raise psycopg2.OperationalError("Pool de base de datos no disponible")
+    # El pool de psycopg2 lanza error al agotarse; el semáforo hace que se espere.
+    with _pool_cupos:
+        conn = pool.getconn()
+        try:
+            yield conn
+            conn.commit()
+        except Exception:
+            if not conn.closed:
+                conn.rollback()
+            raise
+        finally:
+            pool.putconn(conn, close=bool(conn.closed))
+
+
+def cerrar_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None and _pool_pid == os.getpid():
+            _pool.closeall()
+        _pool = None
+
+
+class EscritorHistorial:
+    """Vacía una cola de consultas en INSERT multi-fila por tamaño o por tiempo."""
+
+    _FIN = object()
+
+    def __init__(self, tamano_lote=TAMANO_LOTE, intervalo=INTERVALO_FLUSH, max_cola=MAX_COLA):
+        self.tamano_lote = tamano_lote
+        self.intervalo = intervalo
+        self._cola = queue.Queue(maxsize=max_cola)
+        self._hilo = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _asegurar_hilo(self):
+        # Los hilos no sobreviven a un fork: cada worker arranca el suyo.
+        if self._hilo is not None and self._hilo.is_alive() and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._hilo is None or not self._hilo.is_alive() or self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._hilo = threading.Thread(target=self._bucle, name="escritor-historial", daemon=True)
+                self._hilo.start()
+
+    def encolar(self, celular, mensaje, respuesta):
+        self._asegurar_hilo()
+        try:
+            self._cola.put_nowait((celular, mensaje, respuesta))
+            return True
+        except queue.Full:
+            advertencia("historial_cola_llena", celular=celular)
+            incrementar("historial_filas_total", resultado="descartada")
+            return False
+
+    def pendientes(self):
+        return self._cola.qsize()
+
+    def _bucle(self):
+        terminar = False
+        while not terminar:
+            lote = []
+            try:
+                item = self._cola.get(timeout=self.intervalo)
+            except queue.Empty:
+                continue
+            limite = time.monotonic() + self.intervalo
+            while True:
+                if item is self._FIN:
+                    terminar = True
+                    break
+                lote.append(item)
+                restante = limite - time.monotonic()
+                if len(lote) >= self.tamano_lote or restante <= 0:
+                    break
+                try:
+                    item = self._cola.get(timeout=restante)
+                except queue.Empty:
+                    break
+            if lote:
+                self._escribir(lote)
+
+    def _escribir(self, lote, intentos=2):
+        from psycopg2.extras import execute_values
+        for intento in range(1, intentos + 1):
+            try:
+                with cronometro("db_lote"):
+                    with conexion() as conn:
+                        with conn.cursor() as cursor:
+                            execute_values(cursor, SQL_INSERT_HISTORIAL, lote, page_size=self.tamano_lote)
+                incrementar("historial_filas_total", len(lote), resultado="ok")
+                return True
+            except Exception as e:
+                error("db_error_guardar", registros=len(lote), intento=intento, detalle=str(e))
+        incrementar("historial_filas_total", len(lote), resultado="error")
+        return False
+
+    def detener(self, timeout=5.0):
+        """Pide al hilo que vacíe lo pendiente y espera a que termine."""
+        hilo = self._hilo
+        if hilo is None or not hilo.is_alive() or self._pid != os.getpid():
+            return
+        try:
+            self._cola.put(self._FIN, timeout=timeout)
+        except queue.Full:
+            advertencia("historial_cola_llena_al_cerrar")
+            return
+        hilo.join(timeout)
+
+
+escritor = EscritorHistorial()
+
+
+def encolar_historial(celular, mensaje, respuesta):
+    return escritor.encolar(celular, mensaje, respuesta)
+
+
+def cerrar():
+    escritor.detener()
+    cerrar_pool()
+
+
+atexit.register(cerrar)
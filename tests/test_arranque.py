@@ -0,0 +1,26 @@
+import os
+import subprocess
+import sys
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Se importan en calentar() o al primer uso, nunca al importar bot_core.
+PESADOS = ("google.generativeai", "psycopg2", "twilio")
+
+
+def modulos_importados(codigo):
+    """Módulos que carga `codigo` en un intérprete limpio, según -X importtime."""
+    resultado = subprocess.run([sys.executable, "-X", "importtime", "-c", codigo], cwd=RAIZ,
+                               capture_output=True, text=True, timeout=120, check=True)
+    modulos = set()
+    for linea in resultado.stderr.splitlines():
+        if linea.startswith("import time:") and "|" in linea:
+            modulos.add(linea.rsplit("|", 1)[1].strip())
+    return modulos
+
+
+def test_importar_bot_core_no_carga_dependencias_pesadas():
+    modulos = modulos_importados("import bot_core")
+    assert "bot_core" in modulos
+    cargados = sorted(m for m in modulos for pesado in PESADOS if m == pesado or m.startswith(pesado + "."))
+    assert cargados == []
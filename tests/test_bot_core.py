@@ -0,0 +1,177 @@
+import threading
+import time
+
+import pytest
+
+import bot_core
+import persistencia
+from memoria import Sesion
+
+
+class _Respuesta:
+
+    def __init__(self, texto):
+        self.text = texto
+
+
+class ModeloFalso:
+    """Imita GenerativeModel / ChatSession y guarda lo que recibe."""
+
+    def __init__(self, fragmentos=("**Hola**", " paciente")):
+        self.fragmentos = list(fragmentos)
+        self.prompts = []
+        self.historiales = []
+
+    def start_chat(self, history=None):
+        self.historiales.append(list(history or []))
+        return self
+
+    def send_message(self, prompt, stream=False):
+        self.prompts.append(prompt)
+        if stream:
+            return (_Respuesta(f) for f in self.fragmentos)
+        return _Respuesta("".join(self.fragmentos))
+
+    def generate_content(self, prompt):
+        return _Respuesta("resumen")
+
+
+class ModeloLento(ModeloFalso):
+    """Tarda lo suficiente para que las peticiones simultáneas se solapen."""
+
+    def send_message(self, prompt, stream=False):
+        time.sleep(0.3)
+        return super().send_message(prompt, stream)
+
+
+class SinLimite:
+
+    def permitir(self, clave):
+        return True
+
+
+@pytest.fixture
+def modelo(monkeypatch):
+    falso = ModeloFalso()
+    monkeypatch.setattr(bot_core, "model", falso)
+    monkeypatch.setattr(bot_core, "modelo_resumen", falso)
+    return falso
+
+
+@pytest.fixture
+def filas(monkeypatch):
+    """Escritor de historial propio cuyas filas quedan en una lista en vez de Postgres."""
+    escritas = []
+    escritor = persistencia.EscritorHistorial(intervalo=0.01)
+    monkeypatch.setattr(escritor, "_escribir", lambda lote, intentos=2: escritas.extend(lote) or True)
+    monkeypatch.setattr(persistencia, "escritor", escritor)
+    monkeypatch.setattr(bot_core.memoria, "_cargar", lambda celular: Sesion())
+    monkeypatch.setattr(bot_core, "limitador", SinLimite())
+    yield escritas
+    escritor.detener()
+
+
+def simultaneas(peticiones):
+    """Envía a /chat todas las peticiones a la vez; devuelve los códigos de estado."""
+    barrera = threading.Barrier(len(peticiones))
+    estados = []
+
+    def enviar(kwargs):
+        cliente = bot_core.app.test_client()
+        barrera.wait()
+        estados.append(cliente.post("/chat", **kwargs).status_code)
+
+    hilos = [threading.Thread(target=enviar, args=(kwargs,)) for kwargs in peticiones]
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+    return estados
+
+
+def test_stream_devuelve_el_cupo_aunque_el_cliente_no_lea(modelo):
+    modelo.fragmentos = ["**Hola", "**, esto ", "es una prueba"]
+    fragmentos = bot_core.consultar_gemini_stream("pregunta para probar el stream")
+    primero = next(fragmentos)
+
+    # El cliente no pide más fragmentos; el modelo terminó y el cupo tiene que volver.
+    limite = time.monotonic() + 2
+    while bot_core._cupos_modelo._value < bot_core.MAX_CONSULTAS_SIMULTANEAS and time.monotonic() < limite:
+        time.sleep(0.01)
+    assert bot_core._cupos_modelo._value == bot_core.MAX_CONSULTAS_SIMULTANEAS
+
+    assert primero + "".join(fragmentos) == "*Hola*, esto es una prueba"
+
+
+def test_persona_se_configura_una_vez_y_no_viaja_en_cada_prompt(monkeypatch):
+    import google.generativeai as genai
+
+    creados = []
+
+    class GenerativeModelFalso(ModeloFalso):
+
+        def __init__(self, nombre, system_instruction=None):
+            super().__init__()
+            self.system_instruction = system_instruction
+            creados.append(self)
+
+    monkeypatch.setattr(genai, "GenerativeModel", GenerativeModelFalso)
+    monkeypatch.setattr(genai, "configure", lambda **kwargs: None)
+    monkeypatch.setattr(bot_core, "model", None)
+    monkeypatch.setattr(bot_core, "modelo_resumen", None)
+
+    respuestas = [bot_core.consultar_gemini(m) for m in ("Hola", "me duele la rodilla al correr", "qué ceno hoy")]
+
+    # Un modelo con la persona y otro neutro para los resúmenes; ninguno se recrea por mensaje.
+    assert [m.system_instruction for m in creados] == [None, bot_core.INSTRUCCION_SISTEMA]
+    principal = bot_core.model
+    assert len(principal.prompts) == 3
+    for prompt in principal.prompts:
+        assert bot_core.INSTRUCCION_SISTEMA.strip() not in prompt
+        assert "ROL:" not in prompt
+        # Lo que viaja por mensaje es mucho menor que la persona que antes se concatenaba.
+        assert len(prompt) < len(bot_core.INSTRUCCION_SISTEMA) // 4
+
+    # Mismo comportamiento: el saludo sigue pidiendo la presentación y la respuesta se limpia igual.
+    assert "REGLA 1" in principal.prompts[0]
+    assert principal.prompts[1] == "Pregunta del paciente: me duele la rodilla al correr"
+    assert respuestas == ["*Hola* paciente"] * 3
+
+
+def test_duplicados_simultaneos_hacen_una_llamada_y_una_fila(monkeypatch, filas):
+    modelo = ModeloLento()
+    monkeypatch.setattr(bot_core, "model", modelo)
+    datos = {"From": "+5215512345678", "Body": "me duele la espalda baja desde el lunes"}
+
+    assert simultaneas([{"data": datos}] * 10) == [200] * 10
+    persistencia.escritor.detener()
+
+    assert len(modelo.prompts) == 1
+    assert filas == [("+5215512345678", datos["Body"], "*Hola* paciente")]
+
+
+def test_clientes_web_distintos_no_se_coalescen(monkeypatch, filas):
+    modelo = ModeloLento()
+    monkeypatch.setattr(bot_core, "model", modelo)
+    mensaje = "qué puedo cenar si tengo gastritis"
+    peticiones = [{"json": {"mensaje": mensaje}, "headers": {"X-Forwarded-For": f"10.0.0.{i}"}} for i in range(5)]
+
+    assert simultaneas(peticiones) == [200] * 5
+    persistencia.escritor.detener()
+
+    assert len(modelo.prompts) == 5
+    assert len(filas) == 5
+
+
+def test_stream_guarda_el_historial_aunque_el_cliente_se_desconecte(modelo, filas):
+    modelo.fragmentos = ["Primer ", "fragmento ", "y el resto"]
+    respuesta = bot_core.app.test_client().post("/chat/stream", json={"mensaje": "me arde la garganta al tragar"})
+    primero = next(respuesta.response)
+    assert b"Primer" in primero
+    respuesta.close()
+
+    limite = time.monotonic() + 2
+    while not filas and time.monotonic() < limite:
+        time.sleep(0.01)
+        persistencia.escritor.detener()
+    assert filas == [("Web User", "me arde la garganta al tragar", "Primer fragmento y el resto")]
@@ -0,0 +1,61 @@
+import math
+import random
+
+from cache_respuestas import CacheRespuestas, IndiceSimilitud, _trigramas
+
+PALABRAS = ("tengo dolor de cabeza estomago rodilla desde ayer hace una semana que puedo "
+            "comer tomar para la gripe fiebre tos presion alta diabetes dormir mejor").split()
+
+
+def coseno_directo(indice, texto, doc):
+    """El cálculo anterior: vectores TF-IDF completos de consulta y documento en cada búsqueda."""
+    def vector(grams):
+        vec = {g: tf * indice._idf(g) for g, tf in grams.items()}
+        return vec, math.sqrt(sum(v * v for v in vec.values())) or 1.0
+
+    q, nq = vector(_trigramas(texto))
+    d, nd = vector(_trigramas(doc))
+    return sum(p * d.get(g, 0.0) for g, p in q.items()) / (nq * nd)
+
+
+def test_buscar_coincide_con_el_coseno_completo():
+    azar = random.Random(7)
+    indice = IndiceSimilitud(deriva_idf=0)
+    docs = [" ".join(azar.choice(PALABRAS) for _ in range(5)) + f" {i}" for i in range(200)]
+    for doc in docs:
+        indice.agregar(doc, doc)
+    for doc in docs[:50]:
+        indice.quitar(doc)
+
+    for _ in range(20):
+        consulta = " ".join(azar.choice(PALABRAS) for _ in range(5))
+        esperado = max((coseno_directo(indice, consulta, d), d) for d in docs[50:])
+        clave, sim = indice.buscar(consulta)
+        assert math.isclose(sim, esperado[0])
+        assert math.isclose(coseno_directo(indice, consulta, clave), esperado[0])
+
+
+def test_vectores_de_documentos_no_se_recalculan_en_cada_busqueda(monkeypatch):
+    indice = IndiceSimilitud()
+    for i in range(100):
+        indice.agregar(i, f"tengo dolor de cabeza {i}")
+    indice.buscar("dolor de cabeza")
+
+    calculados = []
+    original = indice._vector
+    monkeypatch.setattr(indice, "_vector", lambda grams: calculados.append(grams) or original(grams))
+    for _ in range(5):
+        indice.buscar("me duele la cabeza")
+    assert len(calculados) == 5  # solo el de cada consulta
+
+
+def test_negacion_no_reutiliza_la_respuesta_afirmativa():
+    cache = CacheRespuestas(umbral_similitud=0.85)
+    cache.guardar("normal", "Tengo dolor de cabeza", "respuesta")
+
+    assert cache.obtener("normal", "tengo dolor de cabeza?") == "respuesta"
+    assert cache.obtener("normal", "no tengo dolor de cabeza") is None
+    assert cache.aciertos_similares == 0
+
+    cache.guardar("normal", "No tengo dolor de cabeza", "otra")
+    assert cache.obtener("normal", "no tengo dolor de cabeza!!") == "otra"
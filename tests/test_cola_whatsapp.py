@@ -0,0 +1,90 @@
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from cola_whatsapp import ColaWhatsApp, DeduplicadorSQLite, partir_mensaje
+
+
+class Contador:
+
+    def __init__(self):
+        self.generados = []
+        self.enviados = []
+        self._lock = threading.Lock()
+
+    def generar(self, celular, mensaje):
+        with self._lock:
+            self.generados.append(mensaje)
+        return f"respuesta a {mensaje}"
+
+    def enviar(self, destino, origen, texto):
+        with self._lock:
+            self.enviados.append(texto)
+
+
+def rafaga(unicos=800, reintentos=200, semilla=7):
+    """1.000 webhooks: cada SID una vez más los reintentos de Twilio, desordenados."""
+    azar = random.Random(semilla)
+    webhooks = [f"SM{i:05d}" for i in range(unicos)]
+    webhooks += [azar.choice(webhooks) for _ in range(reintentos)]
+    azar.shuffle(webhooks)
+    return webhooks
+
+
+def despachar(colas, webhooks):
+    def webhook(i_sid):
+        i, sid = i_sid
+        # Cada webhook cae en un worker cualquiera.
+        cola = colas[i % len(colas)]
+        return cola.encolar(sid, f"+52{int(sid[2:]) % 50}", sid, "whatsapp:+52", "whatsapp:+1")
+
+    with ThreadPoolExecutor(max_workers=32) as ejecutor:
+        estados = list(ejecutor.map(webhook, enumerate(webhooks)))
+    for cola in colas:
+        cola.esperar()
+        cola.detener()
+    return estados
+
+
+def test_rafaga_de_1000_webhooks_genera_una_vez_por_sid():
+    contador = Contador()
+    cola = ColaWhatsApp(contador.generar, enviador=contador.enviar, max_cola=5000)
+
+    estados = despachar([cola], rafaga())
+
+    assert estados.count("encolado") == 800
+    assert estados.count("duplicado") == 200
+    assert sorted(contador.generados) == [f"SM{i:05d}" for i in range(800)]
+    assert len(contador.enviados) == 800
+
+
+def test_reintento_en_otro_worker_no_regenera(tmp_path):
+    ruta = str(tmp_path / "dedup.db")
+    contador = Contador()
+    # Dos "workers": colas distintas con su propia conexión al mismo archivo.
+    colas = [ColaWhatsApp(contador.generar, enviador=contador.enviar, max_cola=5000,
+                          dedup=DeduplicadorSQLite(ruta)) for _ in range(2)]
+
+    estados = despachar(colas, rafaga())
+
+    assert estados.count("duplicado") == 200
+    assert len(contador.generados) == 800
+    assert len(contador.enviados) == 800
+
+
+def test_sid_expirado_se_acepta_de_nuevo(tmp_path):
+    dedup = DeduplicadorSQLite(str(tmp_path / "dedup.db"), ttl=-1)
+    assert dedup.marcar("SM1")
+    assert dedup.marcar("SM1")
+    dedup = DeduplicadorSQLite(str(tmp_path / "otro.db"))
+    assert dedup.marcar("SM1")
+    assert not dedup.marcar("SM1")
+    dedup.olvidar("SM1")
+    assert dedup.marcar("SM1")
+
+
+def test_partir_mensaje_respeta_el_limite():
+    texto = "\n".join("x" * 100 for _ in range(40))
+    trozos = partir_mensaje(texto, maximo=1600)
+    assert all(len(t) <= 1600 for t in trozos)
+    assert "".join(trozos).replace("\n", "") == texto.replace("\n", "")
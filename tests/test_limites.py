@@ -0,0 +1,86 @@
+import threading
+import time
+
+import pytest
+
+import limites
+from limites import Coalescedor, LimitadorMemoria
+
+
+def test_duplicados_simultaneos_hacen_una_sola_llamada():
+    coalescedor = Coalescedor()
+    n = 20
+    llamadas = []
+    resultados = []
+    barrera = threading.Barrier(n)
+
+    def consultar():
+        llamadas.append(1)
+        time.sleep(0.2)
+        return "respuesta"
+
+    def peticion():
+        barrera.wait()
+        resultados.append(coalescedor.ejecutar(("+52", "hola"), consultar))
+
+    hilos = [threading.Thread(target=peticion) for _ in range(n)]
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+
+    assert len(llamadas) == 1
+    assert [r for r, _ in resultados] == ["respuesta"] * n
+    assert sum(lider for _, lider in resultados) == 1
+
+
+def test_claves_distintas_no_se_coalescen():
+    coalescedor = Coalescedor()
+    assert coalescedor.ejecutar("a", lambda: 1) == (1, True)
+    assert coalescedor.ejecutar("a", lambda: 2) == (2, True)
+
+
+def test_el_error_del_lider_llega_a_los_que_esperan():
+    coalescedor = Coalescedor()
+    entro = threading.Event()
+    errores = []
+
+    def fallar():
+        entro.set()
+        time.sleep(0.2)
+        raise RuntimeError("gemini caído")
+
+    def seguidor():
+        entro.wait()
+        try:
+            coalescedor.ejecutar("k", lambda: "no debería correr")
+        except RuntimeError as e:
+            errores.append(str(e))
+
+    hilo = threading.Thread(target=seguidor)
+    hilo.start()
+    with pytest.raises(RuntimeError):
+        coalescedor.ejecutar("k", fallar)
+    hilo.join()
+    assert errores == ["gemini caído"]
+
+
+def test_cubeta_de_tokens(monkeypatch):
+    ahora = [1000.0]
+    monkeypatch.setattr(limites.time, "monotonic", lambda: ahora[0])
+    limitador = LimitadorMemoria(por_minuto=60, rafaga=3)
+
+    assert [limitador.permitir("+52") for _ in range(4)] == [True, True, True, False]
+    assert limitador.permitir("+53")
+    ahora[0] += 1.0
+    assert limitador.permitir("+52")
+    assert not limitador.permitir("+52")
+
+
+def test_clave_limite_usa_el_ultimo_salto_de_x_forwarded_for():
+    import bot_core
+    with bot_core.app.test_request_context("/chat", method="POST",
+                                           headers={"X-Forwarded-For": "6.6.6.6, 10.0.0.1"}):
+        assert bot_core.clave_limite("Web User") == "10.0.0.1"
+    with bot_core.app.test_request_context("/chat", method="POST", data={"From": "whatsapp:+52155"}):
+        assert bot_core.clave_limite("+52155") == "+52155"
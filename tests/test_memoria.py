@@ -0,0 +1,207 @@
+from contextlib import contextmanager
+from datetime import timedelta
+
+import pytest
+
+import memoria as memoria_mod
+import persistencia
+from memoria import MemoriaSesiones, _EPOCA
+
+
+class DBFalsa:
+    """historial_consultas y resumen_conversaciones en memoria, con created_at de la "DB"."""
+
+    def __init__(self):
+        self.filas = []       # (celular, mensaje, respuesta, created_at)
+        self.resumenes = {}   # celular -> (resumen, resumido_hasta)
+        self.consultas = []
+        self._reloj = _EPOCA + timedelta(days=20000)
+
+    def insertar(self, celular, mensaje, respuesta):
+        self._reloj += timedelta(seconds=1)
+        self.filas.append((celular, mensaje, respuesta, self._reloj))
+
+    def ejecutar(self, sql, params):
+        self.consultas.append(sql)
+        if sql == memoria_mod.SQL_TURNOS_NUEVOS:
+            celular, desde, limite = params
+            resumido_hasta = self.resumenes.get(celular, (None, None))[1]
+            filas = sorted((f, m, r) for c, m, r, f in self.filas if c == celular and f > desde)[:limite]
+            return [(resumido_hasta, m, r, f) for f, m, r in filas] or [(resumido_hasta, None, None, None)], 0
+        if sql == memoria_mod.SQL_CARGAR_RESUMEN:
+            (celular,) = params
+            return [self.resumenes[celular]] if celular in self.resumenes else [], 0
+        if sql == memoria_mod.SQL_CARGAR_TURNOS:
+            celular, desde, limite = params
+            filas = [(m, r, f) for c, m, r, f in self.filas if c == celular and f > desde]
+            return sorted(filas, key=lambda t: t[2], reverse=True)[:limite], 0
+        if sql == memoria_mod.SQL_TURNOS_A_RESUMIR:
+            celular, desde, hasta = params
+            return [(m, r) for c, m, r, f in sorted(self.filas, key=lambda t: t[3])
+                    if c == celular and desde < f <= hasta], 0
+        if sql == memoria_mod.SQL_GUARDAR_RESUMEN:
+            celular, resumen, hasta, desde = params
+            if celular in self.resumenes and self.resumenes[celular][1] != desde:
+                return [], 0
+            self.resumenes[celular] = (resumen, hasta)
+            return [], 1
+        raise AssertionError(sql)
+
+
+class _Cursor:
+
+    def __init__(self, db):
+        self.db = db
+        self.rowcount = -1
+        self._filas = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, sql, params):
+        self._filas, self.rowcount = self.db.ejecutar(sql, params)
+
+    def fetchone(self):
+        return self._filas[0] if self._filas else None
+
+    def fetchall(self):
+        return list(self._filas)
+
+
+class _Conexion:
+
+    def __init__(self, db):
+        self.db = db
+
+    def cursor(self):
+        return _Cursor(self.db)
+
+
+@pytest.fixture
+def db(monkeypatch):
+    db = DBFalsa()
+
+    @contextmanager
+    def conexion():
+        yield _Conexion(db)
+
+    monkeypatch.setattr(persistencia, "conexion", conexion)
+    return db
+
+
+def proceso(resumidor=None, presupuesto=1500):
+    """Una MemoriaSesiones por worker; los resúmenes corren en línea."""
+    m = MemoriaSesiones(presupuesto=presupuesto, ttl=30, resumidor=resumidor)
+    m._enviar = m._resumir
+    return m
+
+
+def vencer(m, celular):
+    m._sesiones[celular].cargada = float("-inf")
+
+
+def mensajes(m, celular):
+    return [t["parts"][0] for t in m.historial_para_prompt(celular) if t["role"] == "user"]
+
+
+def test_recarga_tras_ttl_ve_los_turnos_de_otro_worker(db):
+    a, b = proceso(), proceso()
+    for m, texto in ((a, "uno"), (b, "dos")):
+        m.registrar("+52", texto, "ok")
+        db.insertar("+52", texto, "ok")
+
+    assert mensajes(a, "+52") == ["uno"]
+    vencer(a, "+52")
+    assert mensajes(a, "+52") == ["uno", "dos"]
+
+
+def test_turnos_aun_no_insertados_sobreviven_a_la_recarga(db):
+    a = proceso()
+    a.registrar("+52", "uno", "ok")
+    vencer(a, "+52")
+    assert mensajes(a, "+52") == ["uno"]
+
+    db.insertar("+52", "uno", "ok")
+    vencer(a, "+52")
+    assert mensajes(a, "+52") == ["uno"]
+    assert a._sesiones["+52"].turnos[0][2] is not None
+
+
+def test_marca_de_agua_es_el_created_at_de_la_db(db):
+    resumidos = []
+
+    def resumidor(previo, turnos):
+        resumidos.append(list(turnos))
+        return "resumen"
+
+    texto = "x" * 40  # ~10 tokens
+    a = proceso(resumidor, presupuesto=50)
+    for i in range(2):
+        a.registrar("+52", f"{i}{texto}", texto)
+        db.insertar("+52", f"{i}{texto}", texto)
+    vencer(a, "+52")
+    a.registrar("+52", f"2{texto}", texto)
+
+    assert resumidos == [[(f"0{texto}", texto), (f"1{texto}", texto)]]
+    assert db.resumenes["+52"] == ("resumen", db.filas[1][3])
+
+    # Al recargar, los turnos resumidos no vuelven como recientes.
+    db.insertar("+52", f"2{texto}", texto)
+    vencer(a, "+52")
+    assert mensajes(a, "+52") == ["Resumen de nuestra conversación anterior: resumen", f"2{texto}"]
+
+
+def test_resumen_de_otro_worker_no_se_pisa(db):
+    texto = "x" * 40
+    a = proceso(lambda previo, turnos: "de A", presupuesto=50)
+    b = proceso(lambda previo, turnos: "de B", presupuesto=50)
+    for i in range(2):
+        db.insertar("+52", f"{i}{texto}", texto)
+    a.obtener("+52")
+    b.obtener("+52")
+
+    b.registrar("+52", f"2{texto}", texto)
+    a.registrar("+52", f"3{texto}", texto)
+
+    assert db.resumenes["+52"][0] == "de B"
+    assert a._sesiones["+52"].resumen == ""
+    assert a._sesiones["+52"].cargada == float("-inf")
+
+
+def test_sesion_vencida_se_sincroniza_con_una_consulta_de_filas_nuevas(db):
+    a, b = proceso(), proceso()
+    a.registrar("+52", "uno", "ok")
+    db.insertar("+52", "uno", "ok")
+
+    db.consultas.clear()
+    vencer(a, "+52")
+    assert mensajes(a, "+52") == ["uno"]
+    assert db.consultas == [memoria_mod.SQL_TURNOS_NUEVOS]
+    assert a._sesiones["+52"].turnos[0][2] is not None
+
+    # Sin nada nuevo tampoco hay carga completa.
+    db.consultas.clear()
+    vencer(a, "+52")
+    assert mensajes(a, "+52") == ["uno"]
+    assert db.consultas == [memoria_mod.SQL_TURNOS_NUEVOS]
+
+    b.registrar("+52", "dos", "ok")
+    db.insertar("+52", "dos", "ok")
+    a.registrar("+52", "tres", "ok")
+    vencer(a, "+52")
+    assert mensajes(a, "+52") == ["uno", "dos", "tres"]
+
+
+def test_resumen_movido_por_otro_proceso_fuerza_la_carga_completa(db):
+    a = proceso()
+    db.insertar("+52", "uno", "ok")
+    a.obtener("+52")
+    db.resumenes["+52"] = ("de otro worker", db.filas[0][3])
+
+    db.consultas.clear()
+    vencer(a, "+52")
+    assert mensajes(a, "+52") == ["Resumen de nuestra conversación anterior: de otro worker"]
+    assert memoria_mod.SQL_CARGAR_RESUMEN in db.consultas
@@ -0,0 +1,52 @@
+import multiprocessing
+
+from metricas import Registro
+
+fork = multiprocessing.get_context("fork")
+
+
+def trabajador(directorio, mensajes):
+    """Un worker de gunicorn: cuenta, mide, vuelca y muere."""
+    registro = Registro(directorio=directorio)
+    registro.medidor("pendientes", lambda: 7)
+    for _ in range(mensajes):
+        registro.incrementar("mensajes_total", canal="web")
+        registro.observar("etapa_segundos", 0.02, etapa="gemini")
+    registro.volcar()
+
+
+def correr(directorio, mensajes):
+    proceso = fork.Process(target=trabajador, args=(directorio, mensajes))
+    proceso.start()
+    proceso.join()
+    assert proceso.exitcode == 0
+
+
+def test_metrics_suma_los_workers_y_no_retrocede_al_morir_uno(tmp_path):
+    actual = Registro(directorio=str(tmp_path))
+    actual.medidor("pendientes", lambda: 2)
+    actual.incrementar("mensajes_total", 5, canal="web")
+
+    correr(str(tmp_path), 3)
+    texto = actual.exponer()
+    assert 'cuerpofiel_mensajes_total{canal="web"} 8' in texto
+    assert 'cuerpofiel_etapa_segundos_count{etapa="gemini"} 3' in texto
+    assert 'cuerpofiel_etapa_segundos_bucket{etapa="gemini",le="0.025"} 3' in texto
+
+    # Los medidores solo son de workers vivos; el muerto no aparece.
+    medidores = [linea for linea in texto.splitlines() if linea.startswith("cuerpofiel_pendientes")]
+    assert len(medidores) == 1 and medidores[0].endswith(" 2")
+
+    correr(str(tmp_path), 4)
+    actual.incrementar("mensajes_total", canal="web")
+    assert 'cuerpofiel_mensajes_total{canal="web"} 13' in actual.exponer()
+
+
+def test_etiqueta_instancia_en_todas_las_series():
+    registro = Registro(directorio="", instancia="web.2")
+    registro.medidor("pendientes", lambda: 1)
+    registro.incrementar("mensajes_total", canal="web")
+    registro.observar("etapa_segundos", 0.5, etapa="gemini")
+
+    series = [linea for linea in registro.exponer().splitlines() if not linea.startswith("#")]
+    assert series and all('instancia="web.2"' in linea for linea in series)
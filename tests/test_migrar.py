@@ -0,0 +1,41 @@
+import migrar
+
+
+class CursorFalso:
+
+    def __init__(self, tiene_created_at, indice_valido):
+        # indice_valido: None si no existe, True/False según pg_index.indisvalid
+        self.respuestas = {
+            migrar.SQL_EXISTE_CREATED_AT: (1,) if tiene_created_at else None,
+            migrar.SQL_ESTADO_INDICE: None if indice_valido is None else (indice_valido,),
+        }
+        self.ejecutadas = []
+        self._ultima = None
+
+    def execute(self, sql):
+        self.ejecutadas.append(sql)
+        self._ultima = sql
+
+    def fetchone(self):
+        return self.respuestas.get(self._ultima)
+
+
+def test_esquema_al_dia_no_toma_candados():
+    cursor = CursorFalso(tiene_created_at=True, indice_valido=True)
+    assert migrar.migrar(cursor) == []
+    assert migrar.SQL_AGREGAR_CREATED_AT not in cursor.ejecutadas
+    assert migrar.SQL_CREAR_INDICE not in cursor.ejecutadas
+
+
+def test_base_nueva_aplica_todo():
+    cursor = CursorFalso(tiene_created_at=False, indice_valido=None)
+    assert migrar.migrar(cursor) == ["historial_created_at", "idx_historial_celular_fecha"]
+    assert cursor.ejecutadas[0].startswith("SET lock_timeout")
+    assert migrar.SQL_BORRAR_INDICE not in cursor.ejecutadas
+
+
+def test_indice_invalido_se_rehace():
+    cursor = CursorFalso(tiene_created_at=True, indice_valido=False)
+    assert migrar.migrar(cursor) == ["idx_historial_celular_fecha"]
+    i = cursor.ejecutadas.index(migrar.SQL_BORRAR_INDICE)
+    assert cursor.ejecutadas[i + 1] == migrar.SQL_CREAR_INDICE
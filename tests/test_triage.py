@@ -0,0 +1,107 @@
+import pytest
+
+from triage import Triage, cargar_palabras
+
+PALABRAS, NO_CORREGIR, FLEXIONABLES = cargar_palabras()
+
+# La verificación original de bot_core: subcadena sobre el mensaje en mayúsculas.
+PALABRAS_ORIGINALES = ["INFARTO", "SANGRADO PROFUSO", "PÉRDIDA DE CONCIENCIA", "DOLOR INTENSO DE PECHO",
+                       "HEMORRAGIA", "PARO CARDÍACO", "AMBULANCIA", "911", "ACCIDENTE GRAVE", "VENENO",
+                       "ASFIXIA", "PEOR DOLOR DE MI VIDA"]
+
+MENSAJES_FLEXIONADOS = [
+    "mi hijo se está asfixiando",
+    "está asfixiado",
+    "la bebé quedó asfixiada",
+    "se asfixió con la almohada",
+    "tuvo dos hemorragias",
+    "hemorrágico no, hemorragia interna",
+    "le dieron varios infartos",
+    "quedó infartado",
+    "mordida de serpiente venenosa",
+    "se comió unos hongos venenosos",
+    "la niña está envenenada",
+    "se está atragantando con una uva",
+    "está atragantada",
+    "sigue convulsionando",
+    "mi papá convulsionó",
+    "pidan ambulancias",
+    "hubo accidentes graves, un accidente grave en la carretera",
+    "sangrado profuso por la nariz",
+    "Pérdida de conciencia al levantarse",
+    "sufrió un paro cardíaco",
+]
+
+MENSAJES_COMUNES = [
+    "I love cooking vegan food",
+    "strike",
+    "No respiro bien por la nariz",
+    "Quiero bajar de peso, como 9110 calorías",
+    "Me dio un strokeout en el juego",
+]
+
+
+@pytest.fixture
+def exacto():
+    return Triage(PALABRAS, distancia_max=0, no_corregir=NO_CORREGIR, flexionables=FLEXIONABLES)
+
+
+@pytest.fixture
+def difuso():
+    return Triage(PALABRAS, distancia_max=1, no_corregir=NO_CORREGIR, flexionables=FLEXIONABLES)
+
+
+def test_difuso_apagado_por_defecto():
+    assert Triage(PALABRAS).distancia_max == 0
+
+
+@pytest.mark.parametrize("mensaje", MENSAJES_COMUNES)
+def test_mensajes_comunes_no_son_emergencia(exacto, difuso, mensaje):
+    assert exacto.buscar(mensaje) is None
+    assert difuso.buscar(mensaje) is None
+
+
+@pytest.mark.parametrize("mensaje, palabra", [
+    ("Mi papá tuvo un paro cardíaco", "PARO CARDIACO"),
+    ("Creo que es un INFARTO", "INFARTO"),
+    ("Llamen al 911", "911"),
+    ("my son is choking", "CHOKING"),
+    ("Mi hijo no respira", "NO RESPIRA"),
+    ("Ha tenido dos infartos", "INFARTO"),
+    ("Tiene convulsiones desde ayer", "CONVULSION"),
+    ("Llamen al 911.", "911"),
+])
+def test_palabras_clave_exactas(exacto, mensaje, palabra):
+    assert exacto.buscar(mensaje) == palabra
+
+
+def test_difuso_corrige_palabras_clave_sueltas(difuso):
+    assert difuso.buscar("creo que es un infatro") == "INFARTO"
+    assert difuso.buscar("tomó una sobredossis de pastillas") == "SOBREDOSIS"
+
+
+def test_difuso_no_corrige_frases(difuso):
+    # "RESPIRO" está a un cambio de "RESPIRA", pero "NO RESPIRA" es una frase.
+    assert difuso.buscar("no respiro bien") is None
+
+
+@pytest.mark.parametrize("mensaje", MENSAJES_FLEXIONADOS)
+def test_detecta_todo_lo_que_detectaba_la_subcadena_original(exacto, mensaje):
+    if any(palabra in mensaje.upper() for palabra in PALABRAS_ORIGINALES):
+        assert exacto.buscar(mensaje) is not None
+
+
+@pytest.mark.parametrize("mensaje", [
+    "la niña está envenenada",
+    "se está atragantando con una uva",
+    "está atragantada",
+    "mi papá convulsionó",
+    "quedó infartado",
+])
+def test_formas_flexionadas_de_la_lista_actual(exacto, mensaje):
+    assert exacto.buscar(mensaje) is not None
+
+
+def test_sin_flexion_para_palabras_cortas_ni_inglesas(exacto):
+    assert exacto.buscar("como 9110 calorías") is None
+    assert exacto.buscar("she stroked the cat") is None
@@ -0,0 +1,231 @@
+import os
+import re
+import json
+import time
+import threading
+import unicodedata
+
+from metricas import error, evento
+
+# ==========================================
+# TRIAGE DE EMERGENCIA (ALERTA ROJA)
+# ==========================================
+# Se ejecuta antes que cualquier otra cosa en cada mensaje, así que tiene que
+# costar lo mismo con 10 palabras clave que con 1.000:
+#   * El texto y las palabras clave se normalizan igual (NFKD sin acentos,
+#     mayúsculas, puntuación -> espacio), así "paro cardiaco" = "PARO CARDÍACO".
+#   * Todas las palabras clave se compilan en UNA regex construida como trie,
+#     de modo que en cada inicio de palabra el motor avanza por prefijos
+#     compartidos en vez de probar cada palabra clave por separado.
+#   * Coincidencia difusa opcional y apagada por defecto (TRIAGE_DISTANCIA_MAX=1
+#     la activa): cada palabra del mensaje se corrige hacia las palabras clave
+#     de UNA sola palabra con un índice de borrados tipo SymSpell y se repite la
+#     regex. Las frases ("NO RESPIRA") solo coinciden de forma exacta, y las
+#     palabras comunes de "no_corregir" ("COOKING" no es "CHOKING") nunca se
+#     corrigen. El costo depende del largo del mensaje, no de la lista.
+#   * A la derecha de cada palabra clave se exige fin de palabra ("9110" no es
+#     "911"), salvo el plural. Las palabras clave en español de una sola
+#     palabra y 5+ letras admiten además cualquier terminación, como hacía la
+#     búsqueda por subcadena original: "ASFIXIA" cubre "ASFIXIANDO" y
+#     "ASFIXIADO". Las inglesas ya se listan flexionadas ("CHOKING") y no la
+#     admiten, para que "STROKE" no sea "STROKED".
+#   * La lista vive en palabras_emergencia.json y se recarga sola al cambiar.
+
+ARCHIVO_PALABRAS = os.environ.get(
+    "TRIAGE_ARCHIVO", os.path.join(os.path.dirname(os.path.abspath(__file__)), "palabras_emergencia.json"))
+DISTANCIA_MAX = int(os.environ.get("TRIAGE_DISTANCIA_MAX", "0"))
+# Palabras más cortas que esto solo coinciden de forma exacta ("911", "NO").
+LARGO_MIN_DIFUSO = int(os.environ.get("TRIAGE_LARGO_MIN_DIFUSO", "5"))
+INTERVALO_RECARGA = float(os.environ.get("TRIAGE_INTERVALO_RECARGA", "5"))
+# Palabras clave de una sola palabra, alfabéticas y al menos así de largas admiten
+# cualquier terminación si son de un idioma de IDIOMAS_FLEXIONABLES.
+LARGO_MIN_FLEXION = int(os.environ.get("TRIAGE_LARGO_MIN_FLEXION", "5"))
+IDIOMAS_FLEXIONABLES = ("es",)
+
+
+def normalizar(texto):
+    texto = unicodedata.normalize("NFKD", texto)
+    texto = "".join(c for c in texto if not unicodedata.combining(c)).upper()
+    texto = "".join(c if c.isalnum() else " " for c in texto)
+    return " ".join(texto.split())
+
+
+def _trie(palabras):
+    trie = {}
+    for palabra in palabras:
+        nodo = trie
+        for c in palabra:
+            nodo = nodo.setdefault(c, {})
+        nodo[""] = {}
+
+    def a_regex(nodo):
+        fin = "" in nodo
+        ramas = [re.escape(c) + a_regex(hijo) for c, hijo in sorted(nodo.items()) if c]
+        if not ramas:
+            return ""
+        cuerpo = ramas[0] if len(ramas) == 1 else "(?:" + "|".join(ramas) + ")"
+        if fin:
+            return "(?:" + cuerpo + ")?"
+        return cuerpo
+
+    return a_regex(trie)
+
+
+def _regex_trie(palabras, flexionables=()):
+    """Una regex para todas las palabras clave; el último grupo capturado es la palabra clave sin sufijo."""
+    flexionables = sorted(set(flexionables) & set(palabras))
+    estrictas = sorted(set(palabras) - set(flexionables))
+    ramas = []
+    if flexionables:
+        # "ASFIXIA" -> "ASFIXIANDO", "VENENO" -> "VENENOSA".
+        ramas.append("(" + _trie(flexionables) + ")[A-Z]*")
+    if estrictas:
+        # A la derecha solo el plural ("INFARTOS", "CONVULSIONES"), así "9110" no es "911".
+        ramas.append("(" + _trie(estrictas) + ")(?:E?S)?")
+    return re.compile(r"(?<![A-Z0-9])(?:" + "|".join(ramas) + r")(?![A-Z0-9])")
+
+
+def _borrados(texto, distancia):
+    resultado = {texto}
+    frontera = {texto}
+    for _ in range(distancia):
+        siguiente = set()
+        for t in frontera:
+            for i in range(len(t)):
+                siguiente.add(t[:i] + t[i + 1:])
+        resultado |= siguiente
+        frontera = siguiente
+    return resultado
+
+
+def _distancia_acotada(a, b, maximo):
+    """Damerau-Levenshtein (transposición = 1) con corte; maximo + 1 si se pasa."""
+    if abs(len(a) - len(b)) > maximo:
+        return maximo + 1
+    previa, anterior = None, list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        actual = [i]
+        for j, cb in enumerate(b, 1):
+            costo = min(anterior[j] + 1, actual[j - 1] + 1, anterior[j - 1] + (ca != cb))
+            if previa is not None and j > 1 and ca == b[j - 2] and a[i - 2] == cb:
+                costo = min(costo, previa[j - 2] + 1)
+            actual.append(costo)
+        if min(actual) > maximo:
+            return maximo + 1
+        previa, anterior = anterior, actual
+    return anterior[-1]
+
+
+class Triage:
+    """Matcher compilado para un conjunto fijo de palabras clave."""
+
+    def __init__(self, palabras, distancia_max=DISTANCIA_MAX, largo_min_difuso=LARGO_MIN_DIFUSO, no_corregir=(),
+                 flexionables=(), largo_min_flexion=LARGO_MIN_FLEXION):
+        normalizadas = sorted({normalizar(p) for p in palabras if normalizar(p)})
+        self.palabras = normalizadas
+        self.distancia_max = distancia_max
+        self.flexionables = {
+            p for p in map(normalizar, flexionables)
+            if p in normalizadas and p.isalpha() and len(p) >= largo_min_flexion
+        }
+        self._regex = _regex_trie(normalizadas, self.flexionables) if normalizadas else None
+
+        self.largo_min_difuso = largo_min_difuso
+        # Palabras que se dejan tal cual: las de las propias palabras clave y las comunes.
+        self._intactas = {t for palabra in normalizadas for t in palabra.split()}
+        self._intactas |= {normalizar(p) for p in no_corregir}
+        self._borrados = {}
+        if distancia_max > 0:
+            for palabra in normalizadas:
+                if " " in palabra or len(palabra) < largo_min_difuso:
+                    continue
+                for borrado in _borrados(palabra, distancia_max):
+                    self._borrados.setdefault(borrado, set()).add(palabra)
+
+    def buscar(self, mensaje):
+        """Devuelve la palabra clave detectada (normalizada) o None."""
+        if self._regex is None:
+            return None
+        texto = normalizar(mensaje)
+        coincidencia = self._regex.search(texto)
+        if coincidencia:
+            return coincidencia.group(coincidencia.lastindex)
+        if self._borrados:
+            corregido = self._corregir(texto.split())
+            if corregido is not None:
+                coincidencia = self._regex.search(corregido)
+                if coincidencia:
+                    return coincidencia.group(coincidencia.lastindex)
+        return None
+
+    def _corregir(self, tokens):
+        """Reemplaza cada palabra por la del vocabulario más cercana (o None si nada cambia)."""
+        d = self.distancia_max
+        cambios = False
+        corregidos = []
+        for token in tokens:
+            if len(token) >= self.largo_min_difuso and token not in self._intactas:
+                candidatas = set()
+                for borrado in _borrados(token, d):
+                    candidatas |= self._borrados.get(borrado, set())
+                mejor, mejor_d = None, d + 1
+                for candidata in candidatas:
+                    distancia = _distancia_acotada(token, candidata, d)
+                    if distancia < mejor_d:
+                        mejor, mejor_d = candidata, distancia
+                if mejor is not None:
+                    token = mejor
+                    cambios = True
+            corregidos.append(token)
+        return " ".join(corregidos) if cambios else None
+
+
+def cargar_palabras(ruta=ARCHIVO_PALABRAS):
+    """Devuelve (palabras_clave, no_corregir, flexionables)."""
+    with open(ruta, encoding="utf-8") as f:
+        datos = json.load(f)
+    # Formato: {"es": [...], "en": [...], "no_corregir": [...]} (o una lista simple)
+    if isinstance(datos, dict):
+        no_corregir = datos.get("no_corregir", [])
+        palabras = [p for idioma, lista in datos.items() if idioma != "no_corregir" for p in lista]
+        flexionables = [p for idioma in IDIOMAS_FLEXIONABLES for p in datos.get(idioma, [])]
+        return palabras, no_corregir, flexionables
+    return list(datos), [], []
+
+
+class TriageRecargable:
+    """Triage ligado a un archivo; se recompila cuando cambia su mtime."""
+
+    def __init__(self, ruta=ARCHIVO_PALABRAS, intervalo=INTERVALO_RECARGA):
+        self.ruta = ruta
+        self.intervalo = intervalo
+        self._mtime = None
+        self._revisado = 0.0
+        self._lock = threading.Lock()
+        self.actual = Triage([])
+        self._recargar_si_cambio(forzar=True)
+
+    def _recargar_si_cambio(self, forzar=False):
+        ahora = time.monotonic()
+        if not forzar and ahora - self._revisado < self.intervalo:
+            return
+        with self._lock:
+            self._revisado = ahora
+            try:
+                mtime = os.path.getmtime(self.ruta)
+                if mtime == self._mtime:
+                    return
+                palabras, no_corregir, flexionables = cargar_palabras(self.ruta)
+                self.actual = Triage(palabras, no_corregir=no_corregir, flexionables=flexionables)
+                self._mtime = mtime
+                evento("triage_cargado", palabras=len(self.actual.palabras), archivo=self.ruta)
+            except Exception as e:
+                # Si el archivo queda inválido se conserva la última lista buena.
+                error("triage_error_carga", archivo=self.ruta, detalle=str(e))
+
+    def buscar(self, mensaje):
+        self._recargar_si_cambio()
+        return self.actual.buscar(mensaje)
+
+
+triage = TriageRecargable()